@@ -18,12 +18,25 @@
 #
 
 import getpass
+import os
 import MySQLdb
+from MySQLdb.constants import FLAG
 import time
 import re
 import sys
 import traceback
+import threading
+import tempfile
+import base64
+import codecs
+import csv
+import gzip
+import json
 from optparse import OptionParser
+try:
+    import zstandard
+except ImportError:
+    zstandard = None
 
 def parse_options():
     parser = OptionParser()
@@ -35,7 +48,7 @@ def parse_options():
     parser.add_option("-S", "--socket", dest="socket", default="/var/run/mysqld/mysql.sock", help="MySQL socket file. Only applies when host is localhost")
     parser.add_option("", "--defaults-file", dest="defaults_file", default="", help="Read from MySQL configuration file. Overrides all other options")
     parser.add_option("-d", "--database", dest="database", help="Database name (required unless query uses fully qualified table names)")
-    parser.add_option("-e", "--execute", dest="execute_query", help="Query to execute, which contains a chunk placeholder in the form of OAK_CHUNK(table_name) (required)")
+    parser.add_option("-e", "--execute", dest="execute_queries", action="append", default=[], help="Query to execute, which contains a chunk placeholder in the form of OAK_CHUNK(table_name) (required). Repeat to execute multiple queries per chunk, within one transaction")
     parser.add_option("-c", "--chunk-size", dest="chunk_size", type="int", default=1000, help="Number of rows to act on in chunks (default: 1000). 0 means all rows updated in one operation")
     parser.add_option("", "--start-with", dest="start_with", default=None, help="Assuming chunking on numeric field (e.g. AUTO_INCREMENT), start chunking from this value and onward. Either provide a constant or a query returning a single integer value.")
     parser.add_option("", "--end-with", dest="end_with", default=None, help="Assuming chunking on numeric field (e.g. AUTO_INCREMENT), end chunking with this value. Either provide a constant or a query returning a single integer value.")
@@ -43,6 +56,13 @@ def parse_options():
     parser.add_option("", "--force-chunking-column", dest="forced_chunking_column", default=None, help="Columns to chunk by; avoids querying in INFORMATION_SCHEMA. Format: either column_name:type, where type is integer/text/temporal - for single column keys, or column1_name,column2_name,... for one or more column keys, with no type.")
     parser.add_option("", "--skip-lock-tables", dest="skip_lock_tables", action="store_true", default=False, help="Do not issue a LOCK TABLES READ. May be required when using queries within --start-with or --end-with")
     parser.add_option("", "--skip-retry-chunk", dest="skip_retry_chunk", action="store_true", default=False, help="Avoid retrying a chunk operation on error. Default: false")
+    parser.add_option("", "--skip-prepared-statements", dest="skip_prepared_statements", action="store_true", default=False, help="Send the full query text on each chunk, rather than executing a server side prepared statement")
+    parser.add_option("", "--parallel", dest="parallel", type="int", default=1, help="Number of slices of the range to work concurrently, each on its own connection. Default: 1")
+    parser.add_option("", "--state-file", dest="state_file", default=None, help="Record the job's progress in this file after each chunk, so that it can be resumed")
+    parser.add_option("", "--resume", dest="resume", action="store_true", default=False, help="Resume the job recorded in --state-file, right after its last completed chunk")
+    parser.add_option("", "--archive-file", dest="archive_file", default=None, help="Before executing the queries on a chunk, write the chunk's rows to this compressed file. With --parallel, each slice writes a file of its own, numbered before the file's extensions")
+    parser.add_option("", "--archive-format", dest="archive_format", type="choice", choices=["csv", "json"], default="csv", help="Format of --archive-file rows: csv or json (one JSON object per line). Default: csv")
+    parser.add_option("", "--archive-compression", dest="archive_compression", type="choice", choices=["gzip", "zstd"], default="gzip", help="Compression of --archive-file: gzip or zstd (requires the zstandard module). Default: gzip")
     parser.add_option("", "--no-log-bin", dest="no_log_bin", action="store_true", help="Do not log to binary log (actions will not replicate)")
     parser.add_option("", "--sleep", dest="sleep_millis", type="int", default=0, help="Number of milliseconds to sleep between chunks. Default: 0")
     parser.add_option("", "--sleep-ratio", dest="sleep_ratio", type="float", default=0, help="Ratio of sleep time to execution time. Default: 0")
@@ -59,16 +79,26 @@ def verbose(message):
 def print_error(message):
     sys.stderr.write("-- ERROR: %s\n" % message)
 
+def get_password():
+    """
+    Return the MySQL password. When prompting, the user is only asked once,
+    as more than one connection may be opened.
+    """
+    global prompted_password
+    if not options.prompt_password:
+        return options.password
+    if prompted_password is None:
+        prompted_password = getpass.getpass()
+    return prompted_password
+
+
 def open_connection():
     if options.defaults_file:
         conn = MySQLdb.connect(
             read_default_file = options.defaults_file,
             db = database_name)
     else:
-        if options.prompt_password:
-            password=getpass.getpass()
-        else:
-            password=options.password
+        password = get_password()
         conn = MySQLdb.connect(
             host = options.host,
             user = options.user,
@@ -78,15 +108,19 @@ def open_connection():
             unix_socket = options.socket)
     return conn;
 
-def act_query(query):
+def act_query(query, query_args=None, connection=None, commit=True):
     """
-    Run the given query, commit changes
+    Run the given query, commit changes (unless told otherwise).
+    When query_args is given, it is bound into the query's %(name)s placeholders.
+    The global connection is used unless another is given.
     """
-    connection = conn
+    if connection is None:
+        connection = conn
     cursor = connection.cursor()
-    num_affected_rows = cursor.execute(query)
+    num_affected_rows = cursor.execute(query, query_args)
     cursor.close()
-    connection.commit()
+    if commit:
+        connection.commit()
     return num_affected_rows
 
 
@@ -100,8 +134,9 @@ def get_row_nondict(query):
     return row
 
 
-def get_row(query):
-    connection = conn
+def get_row(query, connection=None):
+    if connection is None:
+        connection = conn
     cursor = connection.cursor(MySQLdb.cursors.DictCursor)
     cursor.execute(query)
     row = cursor.fetchone()
@@ -120,11 +155,11 @@ def get_rows(query):
     return rows
 
 
-def get_session_variable_value(session_variable_name):
+def get_session_variable_value(session_variable_name, connection=None):
     query = """
         SELECT @%s AS %s
         """ % (session_variable_name, session_variable_name)
-    row = get_row(query)
+    row = get_row(query, connection)
     session_variable_value = row[session_variable_name]
 
     return session_variable_value
@@ -413,7 +448,7 @@ def get_multiple_columns_non_equality_comparison_by_names(delimited_columns_name
     return get_multiple_columns_non_equality_comparison(columns, values, comparison_sign, include_equality)
 
 
-def set_unique_key_range_end(first_round):
+def set_unique_key_range_end(first_round, connection=None):
     """
     Get the range end: calculate the highest value in the next chunk of rows.
     """
@@ -439,29 +474,41 @@ def set_unique_key_range_end(first_round):
                ",".join(["%s ASC" % unique_key_column_name for unique_key_column_name in unique_key_column_names_list]), limit_count,
                ",".join(["%s DESC" % unique_key_column_name for unique_key_column_name in unique_key_column_names_list]),
                get_unique_key_range_end_variables())
-    act_query(query)
+    act_query(query, connection=connection)
 
 
-def set_unique_key_next_range_start():
+def set_unique_key_next_range_start(connection=None):
     """
     Calculate the starting point of the next range
     """
     query = "SELECT %s INTO %s" % (get_unique_key_range_end_variables(), get_unique_key_range_start_variables())
-    act_query(query)
+    act_query(query, connection=connection)
 
 
-def is_range_overflow(first_round):
+def is_range_overflow(first_round, connection=None):
     if first_round:
         return False
 
     query = """
         SELECT (%s) >= (%s) AS range_overflow
         """ % (get_unique_key_range_start_variables(), get_unique_key_max_values_variables())
-    row = get_row(query)
+    row = get_row(query, connection)
     range_overflow = int(row["range_overflow"])
     return range_overflow
 
 
+def is_range_degenerated(connection=None):
+    """
+    Range end does not advance beyond range start: the range holds no more rows.
+    """
+    query = """
+        SELECT (%s) >= (%s) AS range_degenerated
+        """ % (get_unique_key_range_start_variables(), get_unique_key_range_end_variables())
+    row = get_row(query, connection)
+    range_degenerated = int(row["range_degenerated"])
+    return range_degenerated
+
+
 def get_progress_and_eta_presentation(ratio_complete):
     progress = int(100.0 * ratio_complete)
     return "progress: %d%%" % progress
@@ -482,78 +529,366 @@ def sleep_after_chunk(query_execution_time):
         time.sleep(sleep_seconds)
 
 
-def act_data_pass(first_data_pass_query, rest_data_pass_query, description):
+def get_prepared_statement(query, connection):
+    """
+    Prepare the given chunk query, once per connection. Range variables become parameters.
+    Return the statement name and the names of session variables to execute it with,
+    or None if the query cannot be prepared.
+    """
+    prepared_statements_lock.acquire()
+    try:
+        connection_prepared_statements = prepared_statements.setdefault(id(connection), {})
+    finally:
+        prepared_statements_lock.release()
+    if query not in connection_prepared_statements:
+        parameter_regexp = "@(unique_key_range_(?:start|end)_[0-9]+)"
+        parameter_names = re.findall(parameter_regexp, query)
+        statement_text = re.sub(parameter_regexp, "?", query)
+        statement_name = "oak_chunk_%d" % len(connection_prepared_statements)
+        try:
+            act_query("SET @oak_statement_text = %s", (statement_text,), connection)
+            act_query("PREPARE %s FROM @oak_statement_text" % statement_name, connection=connection)
+            connection_prepared_statements[query] = (statement_name, parameter_names,)
+        except MySQLdb.Error, err:
+            verbose("+ Cannot prepare chunk query (%s); executing as plain query" % err)
+            connection_prepared_statements[query] = None
+    return connection_prepared_statements[query]
+
+
+def forget_prepared_statements(connection):
+    """
+    Prepared statements die with their connection
+    """
+    prepared_statements_lock.acquire()
+    try:
+        prepared_statements.pop(id(connection), None)
+    finally:
+        prepared_statements_lock.release()
+
+
+def act_data_pass_query(query, connection=None, commit=True):
+    """
+    Execute the given chunk query; unless told otherwise, as a server side prepared statement,
+    such that it is only parsed once.
+    """
+    if connection is None:
+        connection = conn
+    if options.skip_prepared_statements:
+        return act_query(query, connection=connection, commit=commit)
+    prepared_statement = get_prepared_statement(query, connection)
+    if prepared_statement is None:
+        return act_query(query, connection=connection, commit=commit)
+    statement_name, parameter_names = prepared_statement
+    if not parameter_names:
+        return act_query("EXECUTE %s" % statement_name, connection=connection, commit=commit)
+    return act_query("EXECUTE %s USING %s" % (statement_name, ", ".join(["@%s" % parameter_name for parameter_name in parameter_names])), connection=connection, commit=commit)
+
+
+def act_data_pass_queries(queries, connection=None, archive_query=None, slice_id=None):
+    """
+    Execute the given chunk queries, all within the same chunk boundaries, in one transaction:
+    either all take effect, or none does. When archive_query is given, the chunk's rows
+    are archived first (to the slice's archive file), within the same transaction.
+    Return the total number of affected rows.
+    """
+    if connection is None:
+        connection = conn
+    if len(queries) == 1 and archive_query is None:
+        return act_data_pass_query(queries[0], connection)
+    if not options.skip_prepared_statements:
+        # get_prepared_statement() commits when it first prepares a query. Prepare all queries
+        # up front, so that no commit falls within the chunk's transaction
+        for query in queries:
+            get_prepared_statement(query, connection)
+    try:
+        if archive_query is not None:
+            archive_chunk_rows(archive_query, connection, slice_id or 0)
+        num_affected_rows_list = [act_data_pass_query(query, connection, False) for query in queries]
+        connection.commit()
+    except:
+        connection.rollback()
+        raise
+    if len(queries) > 1:
+        verbose("+ Rows affected per query: %s" % ", ".join(to_string_list(num_affected_rows_list)))
+    return sum(num_affected_rows_list)
+
+
+def get_archive_file_name(slice_id, num_slices):
+    """
+    With more than one slice, each slice archives to a file of its own, so that slices do not
+    wait on one another: the slice number is added before the file name's extensions,
+    e.g. City.csv.gz becomes City-0.csv.gz, City-1.csv.gz, ...
+    """
+    if num_slices == 1:
+        return options.archive_file
+    archive_directory, archive_file_name = os.path.split(options.archive_file)
+    archive_file_name_tokens = archive_file_name.split(".", 1)
+    archive_file_name_tokens[0] = "%s-%d" % (archive_file_name_tokens[0], slice_id)
+    return os.path.join(archive_directory, ".".join(archive_file_name_tokens))
+
+
+def open_archive_file(archive_file_name):
+    """
+    Open the given archive file for writing. A resumed job appends to the file of the original job;
+    compressed streams are concatenated, such that the file reads as a single stream.
+    """
+    archive = {"file_name": archive_file_name}
+    if options.resume and os.path.exists(archive_file_name):
+        archive["raw_file"] = open(archive_file_name, "ab")
+        archive["header_pending"] = False
+    else:
+        archive["raw_file"] = open(archive_file_name, "wb")
+        archive["header_pending"] = (options.archive_format == "csv")
+    if options.archive_compression == "zstd":
+        archive["file"] = zstandard.ZstdCompressor().stream_writer(archive["raw_file"])
+    else:
+        archive["file"] = gzip.GzipFile(fileobj=archive["raw_file"], mode="wb")
+    verbose("Archiving rows to %s" % archive_file_name)
+    return archive
+
+
+def open_archive_files(num_slices):
+    for slice_id in range(0, num_slices):
+        archives.append(open_archive_file(get_archive_file_name(slice_id, num_slices)))
+
+
+def close_archive_files():
+    for archive in archives:
+        archive["file"].close()
+        if not archive["raw_file"].closed:
+            archive["raw_file"].close()
+
+
+def get_archive_value(value):
+    if value is None:
+        return "\\N"
+    return value
+
+
+def get_archive_json_value(value, is_binary, charset):
+    """
+    Text is decoded by the connection's character set. Binary values (and any text which cannot
+    be decoded) are base64 encoded, as {"base64": ...}, since JSON only holds unicode text.
+    """
+    if not isinstance(value, str):
+        return value
+    if not is_binary:
+        try:
+            return value.decode(charset)
+        except UnicodeDecodeError:
+            pass
+    return {"base64": base64.b64encode(value)}
+
+
+def get_archive_json_row(column_names, row, columns_binary, charset):
+    """
+    A row as a JSON object, keeping the columns in table order
+    """
+    return "{%s}" % ", ".join(["%s: %s" % (json.dumps(column_names[i]), json.dumps(get_archive_json_value(row[i], columns_binary[i], charset), default=str)) for i in range(0, len(row))])
+
+
+def get_python_charset(mysql_charset):
+    if mysql_charset.startswith("utf8"):
+        return "utf-8"
+    try:
+        codecs.lookup(mysql_charset)
+        return mysql_charset
+    except LookupError:
+        return "utf-8"
+
+
+def archive_chunk_rows(archive_query, connection, slice_id):
+    """
+    Read the chunk's rows with an unbuffered (server side) cursor and write them to the slice's archive file,
+    such that memory is bounded regardless of chunk size. Rows are read FOR UPDATE, so that the
+    archived rows are those the chunk's queries then operate on.
+    The file is flushed to disk before returning: rows are archived at least once, though a chunk which
+    fails after being archived may be archived again when retried.
+    Errors other than database errors (e.g. writing the file) are fatal, and recorded in archive_status,
+    so that the chunk is not retried.
+    Return the number of archived rows.
+    """
+    try:
+        num_archived_rows = write_archive_chunk_rows(archive_query, connection, archives[slice_id])
+    except MySQLdb.Error:
+        raise
+    except Exception, err:
+        archive_status["error"] = err
+        raise
+    verbose("+ Rows archived: %d" % num_archived_rows)
+    return num_archived_rows
+
+
+def write_archive_chunk_rows(archive_query, connection, archive):
+    archive_file = archive["file"]
+    num_archived_rows = 0
+    cursor = connection.cursor(MySQLdb.cursors.SSCursor)
+    try:
+        cursor.execute(archive_query)
+        column_names = [column_description[0] for column_description in cursor.description]
+        columns_binary = [bool(column_flags & FLAG.BINARY) for column_flags in cursor.description_flags]
+        charset = get_python_charset(connection.character_set_name())
+        if options.archive_format == "csv":
+            csv_writer = csv.writer(archive_file)
+            if archive["header_pending"]:
+                csv_writer.writerow(column_names)
+                archive["header_pending"] = False
+        rows = cursor.fetchmany(1000)
+        while rows:
+            for row in rows:
+                if options.archive_format == "csv":
+                    csv_writer.writerow([get_archive_value(value) for value in row])
+                else:
+                    archive_file.write(get_archive_json_row(column_names, row, columns_binary, charset))
+                    archive_file.write("\n")
+            num_archived_rows += len(rows)
+            rows = cursor.fetchmany(1000)
+    finally:
+        cursor.close()
+    archive_file.flush()
+    archive["raw_file"].flush()
+    os.fsync(archive["raw_file"].fileno())
+    return num_archived_rows
+
+
+def get_archive_query(first_round):
+    if archive_queries is None:
+        return None
+    return archive_queries[first_round]
+
+
+def get_ratio_complete(connection=None):
+    """
+    Return the ratio of range already worked, or None if this cannot be computed
+    for the unique key type
+    """
+    if unique_key_type == "integer":
+        ratio_complete_query = """
+            SELECT
+                (@unique_key_range_start_0-@unique_key_min_value_0)/
+                (@unique_key_max_value_0-@unique_key_min_value_0)
+                AS ratio_complete
+            """
+    elif unique_key_type == "temporal":
+        ratio_complete_query = """
+            SELECT
+                TIMESTAMPDIFF(SECOND, @unique_key_min_value_0, @unique_key_range_start_0)/
+                TIMESTAMPDIFF(SECOND, @unique_key_min_value_0, @unique_key_max_value_0)
+                AS ratio_complete
+            """
+    else:
+        return None
+    ratio_complete = get_row(ratio_complete_query, connection)["ratio_complete"]
+    if ratio_complete is None:
+        # Single valued range
+        return 1.0
+    return float(ratio_complete)
+
+
+def get_parallel_ratio_complete(slice_id, ratio_complete):
+    """
+    Record a slice's progress, and return the overall progress of all slices.
+    Slices are of roughly equal size.
+    """
+    parallel_status_lock.acquire()
+    try:
+        parallel_status["ratios_complete"][slice_id] = ratio_complete
+        return sum(parallel_status["ratios_complete"])/len(parallel_status["ratios_complete"])
+    finally:
+        parallel_status_lock.release()
+
+
+def is_interrupted():
+    return parallel_status is not None and (parallel_status["interrupted"] or parallel_status["failed"])
+
+
+def act_data_pass(first_data_pass_queries, rest_data_pass_queries, description, connection=None, first_round=True, slice_id=None, resume_range_start_values=None):
     """
     Do the chunk update loop. Main business goes here.
+    The range is taken from the connection's @unique_key_min_value_*, @unique_key_max_value_* variables.
+    With --parallel, this runs per slice, on the slice's connection; a slice other than the
+    first does not include its range start, which is the previous slice's range end.
+    When resume_range_start_values is given, work starts right after these values.
+    Return the number of affected rows.
     """
-    # Is there any range to work with, at all?
-    if not range_exists:
-        return
-    
     start_time = time.time()
 
-    query = """
-        SELECT %s INTO %s
-        """ % (get_unique_key_min_values_variables(), get_unique_key_range_start_variables())
-    act_query(query)
-
-    first_round = True
+    if resume_range_start_values is None:
+        query = """
+            SELECT %s, %s INTO %s, %s
+            """ % (get_unique_key_min_values_variables(), get_unique_key_min_values_variables(),
+                   get_unique_key_range_start_variables(), get_unique_key_range_end_variables())
+        act_query(query, connection=connection)
+    else:
+        set_unique_key_values(get_unique_key_range_start_variables(), resume_range_start_values, connection)
+        set_unique_key_values(get_unique_key_range_end_variables(), resume_range_start_values, connection)
+        first_round = False
+
+    description_prefix = description
+    if slice_id is not None:
+        description_prefix = "%s [slice %d]" % (description, slice_id)
+    if resume_range_start_values is not None:
+        verbose("%s resuming after (%s)" % (description_prefix, ",".join(to_string_list(resume_range_start_values))))
+    interrupted = False
     total_num_affected_rows = 0
     accumulated_work_time = 0;
-    while not is_range_overflow(first_round):
+    while not is_range_overflow(first_round, connection):
+        if is_interrupted():
+            interrupted = True
+            break
         try:
             # Different queries for first round and next rounds
             if first_round:
-                execute_data_pass_query = first_data_pass_query
+                execute_data_pass_queries = first_data_pass_queries
             else:
-                execute_data_pass_query = rest_data_pass_query
-            if not execute_data_pass_query:
+                execute_data_pass_queries = rest_data_pass_queries
+            if not execute_data_pass_queries:
                 # Can happen when chunk-size=0, thus doing everything in one chunk
                 break
     
-            set_unique_key_range_end(first_round)
+            set_unique_key_range_end(first_round, connection)
+            if not first_round and is_range_degenerated(connection):
+                # No rows beyond range start, though range max is not reached
+                break
+            chunk_first_round = first_round
             first_round = False
     
-            unique_key_range_start_values = [get_session_variable_value("unique_key_range_start_%d" % i) for i in range(0,count_columns_in_unique_key)]
-            unique_key_range_end_values = [get_session_variable_value("unique_key_range_end_%d" % i) for i in range(0,count_columns_in_unique_key)]
-                
-            if unique_key_type == "integer":
-                ratio_complete_query = """
-                    SELECT
-                        (@unique_key_range_start_0-@unique_key_min_value_0)/
-                        (@unique_key_max_value_0-@unique_key_min_value_0)
-                        AS ratio_complete
-                    """
-                ratio_complete = float(get_row(ratio_complete_query)["ratio_complete"])
-                verbose("%s range (%s), (%s), %s" % (description, ",".join(to_string_list(unique_key_range_start_values)), ",".join(to_string_list(unique_key_range_end_values)), get_progress_and_eta_presentation(ratio_complete)))
+            unique_key_range_start_values = [get_session_variable_value("unique_key_range_start_%d" % i, connection) for i in range(0,count_columns_in_unique_key)]
+            unique_key_range_end_values = [get_session_variable_value("unique_key_range_end_%d" % i, connection) for i in range(0,count_columns_in_unique_key)]
+
+            ratio_complete = get_ratio_complete(connection)
+            if ratio_complete is not None and slice_id is not None:
+                ratio_complete = get_parallel_ratio_complete(slice_id, ratio_complete)
+            if ratio_complete is None:
+                verbose("%s range (%s), (%s), progress: N/A" % (description_prefix, ",".join(to_string_list(unique_key_range_start_values)), ",".join(to_string_list(unique_key_range_end_values))))
             elif unique_key_type == "temporal":
-                ratio_complete_query = """
-                    SELECT
-                        TIMESTAMPDIFF(SECOND, @unique_key_min_value_0, @unique_key_range_start_0)/
-                        TIMESTAMPDIFF(SECOND, @unique_key_min_value_0, @unique_key_max_value_0)
-                        AS ratio_complete
-                    """
-                ratio_complete = float(get_row(ratio_complete_query)["ratio_complete"])
-                verbose("%s range ('%s', '%s'), %s" % (description, ",".join(to_string_list(unique_key_range_start_values)), ",".join(to_string_list(unique_key_range_end_values)), get_progress_and_eta_presentation(ratio_complete)))
+                verbose("%s range ('%s', '%s'), %s" % (description_prefix, ",".join(to_string_list(unique_key_range_start_values)), ",".join(to_string_list(unique_key_range_end_values)), get_progress_and_eta_presentation(ratio_complete)))
             else:
-                verbose("%s range (%s), (%s), progress: N/A" % (description, ",".join(to_string_list(unique_key_range_start_values)), ",".join(to_string_list(unique_key_range_end_values))))
+                verbose("%s range (%s), (%s), %s" % (description_prefix, ",".join(to_string_list(unique_key_range_start_values)), ",".join(to_string_list(unique_key_range_end_values)), get_progress_and_eta_presentation(ratio_complete)))
     
             num_affected_rows = 0
             query_execution_time = 0
             retry_data_pass = True
             should_sleep_after_chunk = False
             while retry_data_pass:
+                wait_for_shared_backoff()
                 try:
                     query_start_time = time.time()
-                    num_affected_rows = act_query(execute_data_pass_query)
+                    num_affected_rows = act_data_pass_queries(execute_data_pass_queries, connection, get_archive_query(chunk_first_round), slice_id)
                     query_execution_time = (time.time() - query_start_time)
                     accumulated_work_time += query_execution_time
                     total_num_affected_rows += num_affected_rows
                     should_sleep_after_chunk = True
                     retry_data_pass = False
                 except Exception, err:
+                    if archive_status["error"] is not None:
+                        # The chunk's rows cannot be archived; retrying would only archive them partially again
+                        raise
                     print_error("Failed chunk: %s" % err)
-                    sleep_after_chunk(1)
+                    if parallel_status is not None:
+                        set_shared_backoff(1)
+                    else:
+                        sleep_after_chunk(1)
                     if options.skip_retry_chunk:                 
                         retry_data_pass = False
                         verbose("Will not retry same chunk again")
@@ -562,30 +897,373 @@ def act_data_pass(first_data_pass_query, rest_data_pass_query, description):
                         verbose("Retrying same chunk (may lead to infinite loop if problem is inherent to query). Use --skip-retry-chunk to avoid retrying")
             time_now = time.time()
             elapsed_seconds = round(time_now - start_time, 1)
+            if parallel_status is not None:
+                parallel_status_lock.acquire()
+                try:
+                    parallel_status["num_affected_rows"] += num_affected_rows
+                    accumulated_num_affected_rows = parallel_status["num_affected_rows"]
+                finally:
+                    parallel_status_lock.release()
+            else:
+                accumulated_num_affected_rows = total_num_affected_rows
     
             if (query_comment):
                 verbose("+ Query comment: %s" % query_comment)
-            verbose("+ Rows: %d affected, %d accumulating; seconds: %s elapsed; %s executed" % (num_affected_rows, total_num_affected_rows, elapsed_seconds, round(accumulated_work_time, 2)))
+            verbose("+ Rows: %d affected, %d accumulating; seconds: %s elapsed; %s executed" % (num_affected_rows, accumulated_num_affected_rows, elapsed_seconds, round(accumulated_work_time, 2)))
             if num_affected_rows == 0 and options.terminate_on_not_found:
                 verbose("+ Will now terminate due to unfound rows")
                 break;
     
-            set_unique_key_next_range_start()
+            set_unique_key_next_range_start(connection)
+            record_chunk_state(slice_id or 0, unique_key_range_end_values, num_affected_rows)
     
             if should_sleep_after_chunk:
                 sleep_after_chunk(query_execution_time)
         except KeyboardInterrupt:
             # Catch a Ctrl-C. We still want to cleanly close connections
             verbose("User interrupt")
+            interrupted = True
             break
-    verbose("%s range complete. Affected rows: %s" % (description, total_num_affected_rows))
+    if interrupted:
+        verbose("%s range interrupted. Affected rows: %s" % (description_prefix, total_num_affected_rows))
+    else:
+        record_chunk_state(slice_id or 0, None, 0, True)
+        verbose("%s range complete. Affected rows: %s" % (description_prefix, total_num_affected_rows))
+    return total_num_affected_rows
+
+
+def set_unique_key_values(variables, values, connection=None):
+    """
+    Assign the given values to the given comma delimited unique key session variables
+    """
+    query = "SELECT %s INTO %s" % (",".join(["%s"] * len(values)), variables)
+    act_query(query, tuple(values), connection)
+
+
+def get_chunk_state_values(values):
+    """
+    Key values are kept in the state file as strings, which MySQL reads back on resume.
+    Byte strings are kept as they are; numbers and temporal values are formatted.
+    """
+    state_values = []
+    for value in values:
+        if isinstance(value, float):
+            value = repr(value)
+        elif value is not None and not isinstance(value, str):
+            value = str(value)
+        state_values.append(value)
+    return state_values
+
+
+def read_chunk_state_values(state_values):
+    """
+    Restore key values as read from the state file. Strings were written as latin-1, which maps
+    each byte to a character, hence read back into the exact bytes. Integer values are read
+    into integers, as MySQL would compare a string with an integer column as a floating point value.
+    """
+    if state_values is None:
+        return None
+    values = []
+    for state_value in state_values:
+        if state_value is not None:
+            state_value = state_value.encode("latin-1")
+            if unique_key_type == "integer" and count_columns_in_unique_key == 1:
+                state_value = long(state_value)
+        values.append(state_value)
+    return values
+
+
+def create_chunk_state(slices):
+    """
+    Start a new job state, given the slices (min values, max values) it works on.
+    """
+    return {
+        "execute_queries": options.execute_queries,
+        "slices": [{
+            "min_values": get_chunk_state_values(slice_min_values),
+            "max_values": get_chunk_state_values(slice_max_values),
+            "range_end_values": None,
+            "complete": False,
+            } for (slice_min_values, slice_max_values) in slices],
+        "num_affected_rows": 0,
+        "num_chunks": 0,
+        }
+
+
+def read_chunk_state():
+    if not os.path.exists(options.state_file):
+        exit_with_error("Cannot resume: state file %s does not exist" % options.state_file)
+    state_file = open(options.state_file)
+    try:
+        state = json.load(state_file)
+    finally:
+        state_file.close()
+    state["execute_queries"] = [execute_query.encode("latin-1") for execute_query in state["execute_queries"]]
+    for slice_state in state["slices"]:
+        for values_name in ["min_values", "max_values", "range_end_values"]:
+            slice_state[values_name] = read_chunk_state_values(slice_state[values_name])
+    if state["execute_queries"] != options.execute_queries:
+        exit_with_error("Cannot resume: state file %s was written for another query" % options.state_file)
+    verbose("Read state from %s: %d chunks, %d affected rows" % (options.state_file, state["num_chunks"], state["num_affected_rows"]))
+    return state
+
+
+def write_chunk_state():
+    """
+    Write the job state to --state-file, as JSON. The file is replaced atomically, so that
+    an interrupted write never leaves a corrupted state behind.
+    """
+    state_file_descriptor, temporary_state_file_name = tempfile.mkstemp(prefix=".oak-chunk-update-", dir=os.path.dirname(os.path.abspath(options.state_file)))
+    state_file = os.fdopen(state_file_descriptor, "w")
+    try:
+        json.dump(chunk_state, state_file, encoding="latin-1", indent=2)
+        state_file.flush()
+        os.fsync(state_file.fileno())
+    finally:
+        state_file.close()
+    os.rename(temporary_state_file_name, options.state_file)
+
+
+def record_chunk_state(slice_id, range_end_values, num_affected_rows, complete=False):
+    """
+    Record a slice's completed chunk (or the slice's completion) in the job state
+    """
+    if chunk_state is None:
+        return
+    chunk_state_lock.acquire()
+    try:
+        slice_state = chunk_state["slices"][slice_id]
+        if complete:
+            slice_state["complete"] = True
+        else:
+            slice_state["range_end_values"] = get_chunk_state_values(range_end_values)
+            chunk_state["num_chunks"] += 1
+            chunk_state["num_affected_rows"] += num_affected_rows
+        write_chunk_state()
+    finally:
+        chunk_state_lock.release()
+
+
+def set_shared_backoff(backoff_seconds):
+    """
+    With --parallel, a failing chunk (e.g. lock wait timeout, deadlock) indicates contention,
+    which all slices share; so all slices back off.
+    """
+    parallel_status_lock.acquire()
+    try:
+        parallel_status["backoff_until"] = max(parallel_status["backoff_until"], time.time() + backoff_seconds)
+    finally:
+        parallel_status_lock.release()
+
+
+def wait_for_shared_backoff():
+    if parallel_status is None:
+        return
+    backoff_seconds = parallel_status["backoff_until"] - time.time()
+    if backoff_seconds > 0:
+        time.sleep(backoff_seconds)
+
+
+def get_estimated_table_rows():
+    query = """
+        SELECT TABLE_ROWS AS table_rows
+        FROM INFORMATION_SCHEMA.TABLES
+        WHERE TABLE_SCHEMA='%s'
+            AND TABLE_NAME='%s'
+        """ % (database_name, table_name)
+    return int(get_row(query)["table_rows"] or 0)
+
+
+def is_unique_key_range_sparse(estimated_rows):
+    """
+    A single column integer range is sparse when its values are considerably more
+    than its rows, e.g. after old rows were purged while AUTO_INCREMENT values were kept.
+    """
+    if unique_key_type != "integer" or count_columns_in_unique_key != 1:
+        return False
+    key_span = int(unique_key_max_values[0]) - int(unique_key_min_values[0]) + 1
+    return key_span > 2 * estimated_rows
+
+
+def get_next_unique_key_value(values):
+    """
+    Seek the index for the lowest existing unique key value which is not lower than
+    the given one, within the range. Return None when there is no such value.
+    """
+    query = """
+        SELECT %s
+        FROM %s.%s
+        WHERE
+                %s
+            AND
+                %s
+        ORDER BY %s LIMIT 1
+        """ % (unique_key_column_names,
+               database_name, table_name,
+               get_multiple_columns_non_equality_comparison_by_names(unique_key_column_names, ",".join([str(value) for value in values]), ">", True),
+               get_multiple_columns_non_equality_comparison_by_names(unique_key_column_names, get_unique_key_max_values_variables(), "<", True),
+               ",".join(["%s ASC" % unique_key_column_name for unique_key_column_name in unique_key_column_names_list]))
+    row = get_row_nondict(query)
+    if row is None:
+        return None
+    return tuple(row)
+
+
+def get_unique_key_slices_boundaries(num_slices):
+    """
+    Return (up to) num_slices-1 unique key values, by which the range is split into slices
+    of roughly equal size. A dense single column integer key is split arithmetically, and each
+    boundary then seeks the next existing value, so that no slice starts within a gap.
+    Any other key, as well as a sparse integer key, is split by walking the key forward, from one boundary
+    to the next, by the estimated number of rows per slice; slices are thus equal in rows rather than
+    in key values, and the index is walked once overall.
+    """
+    boundaries = []
+    estimated_rows = get_estimated_table_rows()
+    if unique_key_type == "integer" and count_columns_in_unique_key == 1 and not is_unique_key_range_sparse(estimated_rows):
+        min_value = int(unique_key_min_values[0])
+        max_value = int(unique_key_max_values[0])
+        for i in range(1, num_slices):
+            boundary = get_next_unique_key_value((min_value + (max_value - min_value)*i/num_slices,))
+            if boundary is not None:
+                boundaries.append(boundary)
+    else:
+        if unique_key_type == "integer" and count_columns_in_unique_key == 1:
+            verbose("Range is sparse: splitting slices by rows")
+        slice_rows = max(estimated_rows/num_slices, 1)
+        # Walk from the range start (inclusive), then from each boundary (exclusive)
+        set_unique_key_values(get_unique_key_range_start_variables(), unique_key_min_values)
+        for i in range(1, num_slices):
+            query = """
+                SELECT %s
+                FROM %s.%s
+                WHERE
+                        %s
+                    AND
+                        %s
+                ORDER BY %s LIMIT %d, 1
+                """ % (unique_key_column_names,
+                       database_name, table_name,
+                       get_multiple_columns_non_equality_comparison_by_names(unique_key_column_names, get_unique_key_range_start_variables(), ">", (i == 1)),
+                       get_multiple_columns_non_equality_comparison_by_names(unique_key_column_names, get_unique_key_max_values_variables(), "<", True),
+                       ",".join(["%s ASC" % unique_key_column_name for unique_key_column_name in unique_key_column_names_list]),
+                       slice_rows - (i > 1))
+            row = get_row_nondict(query)
+            if row is None:
+                break
+            boundaries.append(tuple(row))
+            set_unique_key_values(get_unique_key_range_start_variables(), row)
+    # Slices may degenerate on small or skewed tables
+    distinct_boundaries = []
+    for boundary in boundaries:
+        if boundary in distinct_boundaries or boundary in [tuple(unique_key_min_values), tuple(unique_key_max_values)]:
+            continue
+        distinct_boundaries.append(boundary)
+    return distinct_boundaries
+
+
+def get_slice_resume_range_start_values(slice_id):
+    """
+    Return the range end of the slice's last recorded chunk, if resuming; None otherwise
+    """
+    if not options.resume:
+        return None
+    return chunk_state["slices"][slice_id]["range_end_values"]
+
+
+def is_slice_complete(slice_id):
+    return options.resume and chunk_state["slices"][slice_id]["complete"]
+
+
+def chunk_update_slice(slice_id, first_data_pass_queries, rest_data_pass_queries, description, slice_min_values, slice_max_values):
+    """
+    Thread: work a single slice of the range on a connection of its own.
+    """
+    connection = None
+    try:
+        try:
+            connection = open_connection()
+            if options.no_log_bin:
+                act_query("SET SESSION SQL_LOG_BIN=0", connection=connection)
+            set_unique_key_values(get_unique_key_min_values_variables(), slice_min_values, connection)
+            set_unique_key_values(get_unique_key_max_values_variables(), slice_max_values, connection)
+            act_data_pass(first_data_pass_queries, rest_data_pass_queries, description, connection, (slice_id == 0), slice_id, get_slice_resume_range_start_values(slice_id))
+        except Exception, err:
+            print_error("Slice %d: %s" % (slice_id, err))
+            parallel_status["failed"] = True
+    finally:
+        if connection:
+            forget_prepared_statements(connection)
+            connection.close()
+
+
+def get_data_pass_slices():
+    """
+    Return the slices, as (min values, max values), into which the range is split.
+    A resumed job works the slices recorded in its state.
+    """
+    if options.resume:
+        return [(slice_state["min_values"], slice_state["max_values"]) for slice_state in chunk_state["slices"]]
+    if options.parallel <= 1:
+        return [(unique_key_min_values, unique_key_max_values)]
+    slices_boundaries = [tuple(unique_key_min_values)] + get_unique_key_slices_boundaries(options.parallel) + [tuple(unique_key_max_values)]
+    return [(slices_boundaries[i], slices_boundaries[i+1]) for i in range(0, len(slices_boundaries) - 1)]
+
+
+def act_parallel_data_pass(first_data_pass_queries, rest_data_pass_queries, description, data_pass_slices):
+    """
+    Work the given slices of the range concurrently.
+    """
+    global parallel_status
+    num_slices = len(data_pass_slices)
+    parallel_status = {
+        "ratios_complete": [0.0] * num_slices,
+        "num_affected_rows": 0,
+        "backoff_until": 0,
+        "interrupted": False,
+        "failed": False,
+        }
+    verbose("%s in %d parallel slices" % (description, num_slices))
+    slices = []
+    for slice_id in range(0, num_slices):
+        (slice_min_values, slice_max_values) = data_pass_slices[slice_id]
+        if is_slice_complete(slice_id):
+            verbose("- slice %d: (%s), (%s) is already complete" % (slice_id, ",".join(to_string_list(slice_min_values)), ",".join(to_string_list(slice_max_values))))
+            parallel_status["ratios_complete"][slice_id] = 1.0
+            continue
+        verbose("- slice %d: (%s), (%s)" % (slice_id, ",".join(to_string_list(slice_min_values)), ",".join(to_string_list(slice_max_values))))
+        slice_thread = threading.Thread(target=chunk_update_slice, args=(slice_id, first_data_pass_queries, rest_data_pass_queries, description, slice_min_values, slice_max_values,))
+        slice_thread.setDaemon(True)
+        slices.append(slice_thread)
+    for slice_thread in slices:
+        slice_thread.start()
+    for slice_thread in slices:
+        try:
+            # Join with timeout, so as to allow for keyboard interrupts
+            while slice_thread.isAlive():
+                slice_thread.join(1)
+        except KeyboardInterrupt:
+            # Slices complete their current chunk, then quit
+            verbose("User interrupt")
+            parallel_status["interrupted"] = True
+            for slice_thread in slices:
+                slice_thread.join()
+    if parallel_status["failed"]:
+        exit_with_error("%s failed on one or more slices" % description)
+    if parallel_status["interrupted"]:
+        verbose("%s interrupted. Affected rows: %s" % (description, parallel_status["num_affected_rows"]))
+    else:
+        verbose("%s range complete. Affected rows: %s" % (description, parallel_status["num_affected_rows"]))
 
 
 def chunk_update():
     """
     Define the chunking queries, work out the chunks
     """
-    if not range_exists:
+    global chunk_state, archive_queries
+    if options.resume:
+        chunk_state = read_chunk_state()
+    elif not range_exists:
         return
 
     if options.no_log_bin:
@@ -604,13 +1282,39 @@ def chunk_update():
             get_multiple_columns_non_equality_comparison_by_names(fully_qualified_unique_key_column_names, get_unique_key_range_end_variables(), "<", True)
         ) for first_round in [True, False]]
     if options.chunk_size > 0:
-        first_data_pass_query = "%s %s %s" % (options.execute_query[:match.start()], between_statements[0], options.execute_query[match.end():])
-        rest_data_pass_query = "%s %s %s" % (options.execute_query[:match.start()], between_statements[1], options.execute_query[match.end():])
+        first_data_pass_queries = ["%s %s %s" % (execute_query[:match.start()], between_statements[0], execute_query[match.end():]) for (execute_query, match) in zip(options.execute_queries, matches)]
+        rest_data_pass_queries = ["%s %s %s" % (execute_query[:match.start()], between_statements[1], execute_query[match.end():]) for (execute_query, match) in zip(options.execute_queries, matches)]
     else:
-        first_data_pass_query = "%s %s %s" % (options.execute_query[:match.start()], "1", options.execute_query[match.end():])
-        rest_data_pass_query = None
-        verbose("chunk size is zero; Will only execute: %s" % first_data_pass_query)
-    act_data_pass(first_data_pass_query, rest_data_pass_query, "Performing chunks")
+        first_data_pass_queries = ["%s %s %s" % (execute_query[:match.start()], "1", execute_query[match.end():]) for (execute_query, match) in zip(options.execute_queries, matches)]
+        rest_data_pass_queries = None
+        verbose("chunk size is zero; Will only execute: %s" % "; ".join(first_data_pass_queries))
+
+    if options.archive_file:
+        archive_queries = {
+            True: "SELECT * FROM %s.%s WHERE %s FOR UPDATE" % (database_name, table_name, between_statements[0]),
+            False: "SELECT * FROM %s.%s WHERE %s FOR UPDATE" % (database_name, table_name, between_statements[1]),
+            }
+        if options.chunk_size == 0:
+            archive_queries[True] = "SELECT * FROM %s.%s FOR UPDATE" % (database_name, table_name)
+
+    data_pass_slices = get_data_pass_slices()
+    if options.archive_file:
+        open_archive_files(len(data_pass_slices))
+    if options.state_file and not options.resume:
+        chunk_state = create_chunk_state(data_pass_slices)
+        write_chunk_state()
+    if len(data_pass_slices) > 1:
+        act_parallel_data_pass(first_data_pass_queries, rest_data_pass_queries, "Performing chunks", data_pass_slices)
+    elif is_slice_complete(0):
+        verbose("Job recorded in %s is already complete" % options.state_file)
+    else:
+        if options.resume:
+            (slice_min_values, slice_max_values) = data_pass_slices[0]
+            set_unique_key_values(get_unique_key_min_values_variables(), slice_min_values)
+            set_unique_key_values(get_unique_key_max_values_variables(), slice_max_values)
+        act_data_pass(first_data_pass_queries, rest_data_pass_queries, "Performing chunks", resume_range_start_values=get_slice_resume_range_start_values(0))
+    if chunk_state is not None:
+        verbose("Job totals: %d chunks, %d affected rows" % (chunk_state["num_chunks"], chunk_state["num_affected_rows"]))
 
 
 def exit_with_error(error_message):
@@ -625,26 +1329,48 @@ try:
     try:
         conn = None
         reuse_conn = True
+        prepared_statements = {}
+        prepared_statements_lock = threading.Lock()
+        prompted_password = None
+        parallel_status = None
+        parallel_status_lock = threading.Lock()
+        chunk_state = None
+        chunk_state_lock = threading.Lock()
+        archive_queries = None
+        archives = []
+        archive_status = {"error": None}
         (options, args) = parse_options()
 
         if options.chunk_size < 0:
             exit_with_error("Chunk size must be nonnegative number. You can leave the default 1000 if unsure")
 
-        if not options.execute_query:
+        if options.parallel < 1:
+            exit_with_error("--parallel must be a positive number")
+        if options.parallel > 1 and options.chunk_size == 0:
+            exit_with_error("--parallel requires a positive chunk size")
+
+        if options.resume and not options.state_file:
+            exit_with_error("--resume requires --state-file")
+        if options.archive_file and options.archive_compression == "zstd" and zstandard is None:
+            exit_with_error("--archive-compression=zstd requires the zstandard python module")
+
+        if not options.execute_queries:
             exit_with_error("Query to execute must be provided via -e or --execute")
 
         match_regexp = "OAK_CHUNK[\\s]*\((.*?)\)"
-        match = re.search(match_regexp, options.execute_query)
-        if not match:
+        matches = [re.search(match_regexp, execute_query) for execute_query in options.execute_queries]
+        if None in matches:
             exit_with_error("Query must include the following token: 'OAK_CHUNK(table_name)', where table_name should be replaced with a table which consists of an AUTO_INCREMENT column by which chunks are made.")
+        if len(set([match.group(1).strip() for match in matches])) > 1:
+            exit_with_error("All queries must chunk by the same table: OAK_CHUNK(...) differs between queries")
 
         comment_regexp = "/\*(.*?)\*/"
-        query_comment_match = re.search(comment_regexp, options.execute_query)
+        query_comment_matches = [re.search(comment_regexp, execute_query) for execute_query in options.execute_queries]
         query_comment = None
-        if query_comment_match:
-            query_comment = query_comment_match.group(1).strip()
+        if filter(None, query_comment_matches):
+            query_comment = filter(None, query_comment_matches)[0].group(1).strip()
             
-        table_name_match = match.group(1).strip()
+        table_name_match = matches[0].group(1).strip()
 
         database_name = None
         table_name =  None
@@ -686,3 +1412,4 @@ try:
 finally:
     if conn:
         conn.close()
+    close_archive_files()
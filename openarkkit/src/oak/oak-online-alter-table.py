@@ -22,9 +22,17 @@ import MySQLdb
 import time
 import re
 import sys
+import os
+import subprocess
+import threading
+import signal
+import json
+import tempfile
+import Queue
+from collections import deque
 from optparse import OptionParser
 
-def parse_options():
+def get_options_parser():
     parser = OptionParser()
     parser.add_option("-u", "--user", dest="user", default="", help="MySQL user")
     parser.add_option("-H", "--host", dest="host", default="localhost", help="MySQL host (default: localhost)")
@@ -35,19 +43,58 @@ def parse_options():
     parser.add_option("", "--defaults-file", dest="defaults_file", default="", help="Read from MySQL configuration file. Overrides all other options")
     parser.add_option("-d", "--database", dest="database", help="Database name (required unless table is fully qualified)")
     parser.add_option("-t", "--table", dest="table", help="Table to alter (optionally fully qualified)")
+    parser.add_option("", "--tables", dest="tables", default="", help="Comma delimited list of tables or LIKE patterns (optionally fully qualified), e.g. orders_%. Alters all matching tables, each in its own process")
+    parser.add_option("", "--concurrency", dest="concurrency", type="int", default=4, help="With --tables, maximum number of tables altered at a time. Default: 4")
     parser.add_option("-g", "--ghost", dest="ghost", help="Table name to serve as ghost. This table will be created and synchronized with the original table")
     parser.add_option("-a", "--alter", dest="alter_statement", help="Comma delimited ALTER statement details, excluding the 'ALTER TABLE t' itself")
     parser.add_option("-c", "--chunk-size", dest="chunk_size", type="int", default=1000, help="Number of rows to act on in chunks. Default: 1000")
+    parser.add_option("", "--chunk-time-ms", dest="chunk_time_ms", type="int", default=0, help="Target execution time per chunk, in milliseconds. When given, chunk size is adapted to meet it, starting with --chunk-size. Default: 0 (fixed chunk size)")
+    parser.add_option("", "--min-chunk-size", dest="min_chunk_size", type="int", default=100, help="Lowest chunk size to adapt to with --chunk-time-ms. Default: 100")
+    parser.add_option("", "--max-chunk-size", dest="max_chunk_size", type="int", default=100000, help="Highest chunk size to adapt to with --chunk-time-ms. Default: 100000")
+    parser.add_option("-w", "--workers", dest="workers", type="int", default=1, help="Number of concurrent workers (connections) for the copy data pass. Implies --client-side-chunking. Default: 1")
+    parser.add_option("", "--defer-secondary-keys", dest="defer_secondary_keys", action="store_true", default=False, help="Copy into a ghost table with unique keys only, then add the (non-unique) secondary keys in a single ALTER before the delete pass. With trigger based capture, keys are added with LOCK=NONE, requiring MySQL 5.6 or later")
+    parser.add_option("", "--plan-chunks", dest="plan_chunks", action="store_true", default=False, help="Compute all copy chunk boundaries up front, from the key distribution as sampled by the optimizer's estimates, saving the boundary query per chunk. Applies to a single column integer key. Implies --client-side-chunking")
+    parser.add_option("", "--chunk-plan-file", dest="chunk_plan_file", default=None, help="Read chunk boundaries from this (JSON) file if it exists; otherwise plan and write them to it. Implies --plan-chunks")
     parser.add_option("-l", "--lock-chunks", action="store_true", dest="lock_chunks", default=False, help="Use LOCK TABLES for each chunk")
     parser.add_option("-N", "--skip-binlog", dest="skip_binlog", action="store_true", default=False, help="Disable binary logging")
+    parser.add_option("", "--client-side-chunking", dest="client_side_chunking", action="store_true", default=False, help="Compute chunk boundaries on client side, binding range values into the chunk queries. Saves several round trips per chunk")
+    parser.add_option("", "--skip-prepared-statements", dest="skip_prepared_statements", action="store_true", default=False, help="Send the full data pass query text on each chunk, rather than executing a server side prepared statement")
     parser.add_option("-r", "--max-lock-retries", type="int", dest="max_lock_retries", default="10", help="Maximum times to retry on deadlock or lock_wait_timeout. (default: 10; 0 is unlimited)")
     parser.add_option("--skip-delete-pass", dest="skip_delete_pass", action="store_true", default=False, help="Do not execute the DELETE data pass")
+    parser.add_option("", "--auto-skip-delete-pass", dest="auto_skip_delete_pass", action="store_true", default=False, help="Do not execute the DELETE data pass when the table's engine (InnoDB, MyISAM) guarantees no rows are orphaned in the ghost table")
+    parser.add_option("", "--delete-pass-method", dest="delete_pass_method", type="choice", choices=["not-in", "anti-join"], default="not-in", help="How the DELETE data pass identifies ghost rows missing from original table: not-in (subquery) or anti-join (LEFT JOIN ... IS NULL). Default: not-in")
     parser.add_option("--sleep", dest="sleep_millis", type="int", default=0, help="Number of milliseconds to sleep between chunks. Default: 0")
     parser.add_option("", "--sleep-ratio", dest="sleep_ratio", type="float", default=0, help="Ratio of sleep time to execution time. Default: 0")
+    parser.add_option("", "--replicas", dest="replicas", default="", help="Comma delimited list of replicas (host or host:port) to monitor for replication lag. Credentials are same as for the master")
+    parser.add_option("", "--max-lag", dest="max_lag", type="int", default=0, help="Pause chunking while any replica in --replicas lags more than given number of seconds. Default: 0 (disabled)")
+    parser.add_option("", "--max-load", dest="max_load", default="", help="Comma delimited status_name=threshold list, e.g. Threads_running=50. Pause chunking while any of these global status values exceeds its threshold")
+    parser.add_option("", "--critical-load", dest="critical_load", default="", help="Comma delimited status_name=threshold list, e.g. Threads_running=200. Abort and cleanup when any of these global status values exceeds its threshold")
+    parser.add_option("", "--checkpoint", dest="checkpoint", action="store_true", default=False, help="Record progress in a checkpoint table after each chunk. On failure, ghost table and triggers are kept so that the operation can be resumed")
+    parser.add_option("", "--resume", dest="resume", action="store_true", default=False, help="Resume a previously failed --checkpoint run, continuing from its last recorded chunk. Implies --checkpoint")
+    parser.add_option("", "--verify", dest="verify", action="store_true", default=False, help="After data passes, compare original and ghost tables chunk by chunk (checksum over shared columns), re-copying mismatched chunks")
+    parser.add_option("", "--estimate", dest="estimate", action="store_true", default=False, help="Do not alter; sample chunks and project duration, rows, bytes written and binary log volume")
+    parser.add_option("", "--estimate-samples", dest="estimate_samples", type="int", default=10, help="With --estimate, number of chunks to sample. Default: 10")
+    parser.add_option("", "--summary-file", dest="summary_file", default=None, help="Write a JSON summary of data passes metrics (rows, timing, latency percentiles) to given file upon completion")
+    parser.add_option("", "--capture", dest="capture", type="choice", choices=["triggers", "binlog"], default="triggers", help="How changes to the table are captured while copying: triggers (AFTER INSERT/UPDATE/DELETE triggers) or binlog (row based binary logs, applied asynchronously; requires MySQL 8.0.13 or later). Default: triggers")
+    parser.add_option("", "--mysqlbinlog", dest="mysqlbinlog", default="mysqlbinlog", help="Path to the mysqlbinlog utility, with --capture=binlog. Default: mysqlbinlog")
+    parser.add_option("", "--binlog-apply-interval", dest="binlog_apply_interval", type="int", default=500, help="With --capture=binlog, milliseconds between applying captured changes. Changes to same row within an interval are coalesced. Default: 500")
+    parser.add_option("", "--binlog-batch-size", dest="binlog_batch_size", type="int", default=500, help="With --capture=binlog, number of rows per multi-row REPLACE/DELETE statement applying captured changes. Default: 500")
+    parser.add_option("", "--binlog-dir", dest="binlog_dir", default=None, help="With --capture=binlog, read binary logs from this local directory rather than from the server")
+    parser.add_option("", "--postpone-cut-over", dest="postpone_cut_over", action="store_true", default=False, help="After data passes complete, keep the ghost table in sync and wait for SIGUSR1 or --cut-over-flag-file before swapping tables")
+    parser.add_option("", "--cut-over-flag-file", dest="cut_over_flag_file", default=None, help="With --postpone-cut-over, proceed to cut-over once this file exists")
+    parser.add_option("", "--postponed-cut-over-report-interval", dest="postponed_cut_over_report_interval", type="int", default=60, help="With --postpone-cut-over, seconds between sync lag reports while waiting. Default: 60")
+    parser.add_option("", "--foreign-keys-method", dest="foreign_keys_method", type="choice", choices=["none", "rebuild-constraints", "drop-swap"], default="none", help="How to handle a table with foreign keys: none (refuse such tables), rebuild-constraints (after cut-over, rebuild child tables' constraints to reference the new table) or drop-swap (drop original table, rename ghost in its place). Default: none")
+    parser.add_option("", "--cut-over-lock-timeout", dest="cut_over_lock_timeout", type="int", default=1, help="Seconds to wait on metadata locks in each cut-over attempt (lock_wait_timeout), during which the table is blocked. Default: 1")
+    parser.add_option("", "--cut-over-retries", dest="cut_over_retries", type="int", default=10, help="Number of cut-over attempts per round, with growing backoff in between. Default: 10")
+    parser.add_option("", "--cut-over-rounds", dest="cut_over_rounds", type="int", default=1, help="Number of rounds of --cut-over-retries attempts, the ghost table kept in sync in between. The utility fails if all rounds fail. Default: 1; 0 is unlimited")
+    parser.add_option("", "--cut-over-long-trx-seconds", dest="cut_over_long_trx_seconds", type="int", default=10, help="Postpone a cut-over attempt while transactions open for longer than given number of seconds may hold locks on the table. Such transactions are told by performance_schema.metadata_locks on MySQL 5.7 or later; otherwise any long running transaction postpones the attempt. Default: 10")
     parser.add_option("--cleanup", dest="cleanup", action="store_true", default=False, help="Remove custom triggers, ghost table from possible previous runs")
     parser.add_option("-v", "--verbose", dest="verbose", action="store_true", default=True, help="Print user friendly messages")
     parser.add_option("-q", "--quiet", dest="verbose", action="store_false", help="Quiet mode, do not verbose")
-    return parser.parse_args()
+    return parser
+
+def parse_options():
+    return get_options_parser().parse_args()
 
 def verbose(message):
     if options.verbose:
@@ -56,15 +103,25 @@ def verbose(message):
 def print_error(message):
     sys.stderr.write("-- ERROR: %s\n" % message)
 
+def get_password():
+    """
+    Return the MySQL password. When prompting, the user is only asked once,
+    as more than one connection may be opened.
+    """
+    global prompted_password
+    if not options.prompt_password:
+        return options.password
+    if prompted_password is None:
+        prompted_password = getpass.getpass()
+    return prompted_password
+
+
 def open_connection():
     verbose("Connecting to MySQL")
     if options.defaults_file:
         conn = MySQLdb.connect(read_default_file = options.defaults_file)
     else:
-        if options.prompt_password:
-            password=getpass.getpass()
-        else:
-            password=options.password
+        password = get_password()
         conn = MySQLdb.connect(
             host = options.host,
             user = options.user,
@@ -75,18 +132,47 @@ def open_connection():
     return conn;
 
 
-def act_query(query):
+def open_replica_connection(replica_host, replica_port):
     """
-    Run the given query, commit changes
+    Open a connection on a replica, using same credentials as for the master
     """
-    connection = conn
+    if options.defaults_file:
+        replica_conn = MySQLdb.connect(read_default_file = options.defaults_file, host = replica_host, port = replica_port)
+    else:
+        replica_conn = MySQLdb.connect(
+            host = replica_host,
+            user = options.user,
+            passwd = get_password(),
+            port = replica_port)
+    return replica_conn
+
+
+def act_query(query, query_args=None, connection=None):
+    """
+    Run the given query, commit changes.
+    When query_args is given, it is bound into the query's %(name)s placeholders.
+    The global connection is used unless another is given.
+    """
+    if connection is None:
+        connection = conn
     cursor = connection.cursor()
-    num_affected_rows = cursor.execute(query)
+    num_affected_rows = cursor.execute(query, query_args)
     cursor.close()
     connection.commit()
     return num_affected_rows
 
 
+def get_row_nondict(query, query_args=None, connection=None):
+    if connection is None:
+        connection = conn
+    cursor = connection.cursor()
+    cursor.execute(query, query_args)
+    row = cursor.fetchone()
+
+    cursor.close()
+    return row
+
+
 def get_row(query):
     connection = conn
     cursor = connection.cursor(MySQLdb.cursors.DictCursor)
@@ -226,6 +312,23 @@ def get_shared_unique_key_columns(shared_unique_key_column_names_set):
     return unique_key_column_names, original_table_unique_key_name, count_columns_in_unique_key, unique_key_type
 
 
+def get_table_estimated_rows():
+    """
+    Return the number of rows in the original table, as estimated by INFORMATION_SCHEMA
+    """
+    query = """
+        SELECT TABLE_ROWS
+        FROM INFORMATION_SCHEMA.TABLES
+        WHERE TABLE_SCHEMA='%s'
+            AND TABLE_NAME='%s'
+        """ % (database_name, original_table_name)
+
+    row = get_row(query)
+    if not row or row['TABLE_ROWS'] is None:
+        return 0
+    return int(row['TABLE_ROWS'])
+
+
 def get_table_engine():
     """
     Return the storage engine (lowercase) the given table belongs to.
@@ -289,6 +392,184 @@ def validate_no_foreign_keys_exist():
     return count == 0
 
 
+def get_foreign_keys(condition):
+    """
+    Return the foreign keys matching the given condition (on REFERENTIAL_CONSTRAINTS, as rc),
+    each as a dict of its table, name, columns, referenced table and columns, and rules.
+    """
+    query = """
+        SELECT
+            rc.CONSTRAINT_SCHEMA, rc.TABLE_NAME, rc.CONSTRAINT_NAME,
+            rc.UNIQUE_CONSTRAINT_SCHEMA, rc.REFERENCED_TABLE_NAME,
+            rc.UPDATE_RULE, rc.DELETE_RULE,
+            GROUP_CONCAT(kcu.COLUMN_NAME ORDER BY kcu.ORDINAL_POSITION) AS COLUMN_NAMES,
+            GROUP_CONCAT(kcu.REFERENCED_COLUMN_NAME ORDER BY kcu.ORDINAL_POSITION) AS REFERENCED_COLUMN_NAMES
+        FROM INFORMATION_SCHEMA.REFERENTIAL_CONSTRAINTS AS rc
+            JOIN INFORMATION_SCHEMA.KEY_COLUMN_USAGE AS kcu ON (
+                kcu.CONSTRAINT_SCHEMA = rc.CONSTRAINT_SCHEMA
+                AND kcu.TABLE_NAME = rc.TABLE_NAME
+                AND kcu.CONSTRAINT_NAME = rc.CONSTRAINT_NAME
+            )
+        WHERE %s
+        GROUP BY rc.CONSTRAINT_SCHEMA, rc.TABLE_NAME, rc.CONSTRAINT_NAME
+        """ % condition
+    foreign_keys = []
+    for row in get_rows(query):
+        foreign_keys.append({
+            "schema": row["CONSTRAINT_SCHEMA"],
+            "table": row["TABLE_NAME"],
+            "name": row["CONSTRAINT_NAME"],
+            "columns": row["COLUMN_NAMES"].split(","),
+            "referenced_schema": row["UNIQUE_CONSTRAINT_SCHEMA"],
+            "referenced_table": row["REFERENCED_TABLE_NAME"],
+            "referenced_columns": row["REFERENCED_COLUMN_NAMES"].split(","),
+            "update_rule": row["UPDATE_RULE"],
+            "delete_rule": row["DELETE_RULE"],
+            })
+    return foreign_keys
+
+
+def get_child_side_foreign_keys():
+    """
+    Foreign keys defined on the original table, referencing parent tables
+    """
+    return get_foreign_keys("rc.CONSTRAINT_SCHEMA='%s' AND rc.TABLE_NAME='%s'" % (database_name, original_table_name))
+
+
+def get_parent_side_foreign_keys():
+    """
+    Foreign keys defined on child tables, referencing the original table
+    """
+    return get_foreign_keys("rc.UNIQUE_CONSTRAINT_SCHEMA='%s' AND rc.REFERENCED_TABLE_NAME='%s'" % (database_name, original_table_name))
+
+
+def get_swapped_constraint_name(constraint_name):
+    """
+    Constraint names are unique per schema, so a recreated constraint cannot reuse the name.
+    Toggling a leading underscore lets repeated alters alternate between two names.
+    """
+    if constraint_name.startswith("_"):
+        return constraint_name[1:]
+    return "_" + constraint_name
+
+
+def get_foreign_key_clause(foreign_key, constraint_name, referenced_table_name):
+    return "CONSTRAINT `%s` FOREIGN KEY (%s) REFERENCES `%s`.`%s` (%s) ON DELETE %s ON UPDATE %s" % (
+        constraint_name,
+        ", ".join(["`%s`" % column_name for column_name in foreign_key["columns"]]),
+        foreign_key["referenced_schema"], referenced_table_name,
+        ", ".join(["`%s`" % column_name for column_name in foreign_key["referenced_columns"]]),
+        foreign_key["delete_rule"], foreign_key["update_rule"])
+
+
+def validate_foreign_keys_supported():
+    """
+    Self referencing foreign keys would have the ghost table reference the original one.
+    """
+    for foreign_key in get_child_side_foreign_keys():
+        if foreign_key["referenced_schema"] == database_name and foreign_key["referenced_table"] == original_table_name:
+            return False
+    return True
+
+
+def add_ghost_foreign_keys():
+    """
+    CREATE TABLE ... LIKE does not copy foreign keys. Recreate the original table's foreign keys
+    on the (still empty) ghost table, unless the ALTER dropped their columns.
+    """
+    ghost_foreign_keys_clauses = []
+    for foreign_key in get_child_side_foreign_keys():
+        if not set([column_name.lower() for column_name in foreign_key["columns"]]).issubset(set([shared_column.lower() for shared_column in shared_columns])):
+            verbose("Foreign key %s is not recreated on ghost table, as its columns are no longer shared" % foreign_key["name"])
+            continue
+        ghost_foreign_keys_clauses.append("ADD %s" % get_foreign_key_clause(foreign_key, get_swapped_constraint_name(foreign_key["name"]), foreign_key["referenced_table"]))
+    if not ghost_foreign_keys_clauses:
+        return
+    query = "ALTER TABLE %s.%s %s" % (database_name, ghost_table_name, ", ".join(ghost_foreign_keys_clauses))
+    act_query(query)
+    verbose("Foreign keys added to %s.%s" % (database_name, ghost_table_name))
+
+
+def rebuild_child_foreign_keys():
+    """
+    After the rename, child tables' foreign keys follow the original table to its archive name.
+    Point them at the new table. Constraints are added with foreign_key_checks disabled,
+    so that existing rows are not re-validated (they hold, as both tables have same rows),
+    and InnoDB adds them in place.
+    Until rebuilt, a child's constraint references the archive table, and is not enforced
+    against the new table. Foreign keys not yet rebuilt are listed in cut_over_status, so that
+    a failure leaves the archive table in place.
+    """
+    pending_child_foreign_keys = list(parent_side_foreign_keys)
+    cut_over_status["pending_child_foreign_keys"] = pending_child_foreign_keys
+    act_query("SET SESSION foreign_key_checks = 0")
+    try:
+        for foreign_key in parent_side_foreign_keys:
+            act_query_retrying_lock_wait(get_rebuild_child_foreign_key_query(foreign_key))
+            pending_child_foreign_keys.remove(foreign_key)
+            verbose("Foreign key %s on %s.%s rebuilt, referencing %s.%s" % (foreign_key["name"], foreign_key["schema"], foreign_key["table"], database_name, original_table_name))
+    finally:
+        act_query("SET SESSION foreign_key_checks = 1")
+
+
+def get_rebuild_child_foreign_key_query(foreign_key):
+    return "ALTER TABLE `%s`.`%s` DROP FOREIGN KEY `%s`, ADD %s" % (foreign_key["schema"], foreign_key["table"], foreign_key["name"],
+        get_foreign_key_clause(foreign_key, get_swapped_constraint_name(foreign_key["name"]), original_table_name))
+
+
+def act_query_retrying_lock_wait(query):
+    """
+    Run the given DDL with lock_wait_timeout set to --cut-over-lock-timeout, so that it never blocks
+    the tables involved for longer than that while queued on metadata locks. Retry with backoff
+    until it succeeds.
+    """
+    original_lock_wait_timeout = get_row_nondict("SELECT @@session.lock_wait_timeout")[0]
+    act_query("SET SESSION lock_wait_timeout = %d" % options.cut_over_lock_timeout)
+    try:
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                return act_query(query)
+            except MySQLdb.OperationalError, err:
+                # 1205: Lock wait timeout exceeded
+                if err.args[0] != 1205:
+                    raise
+                verbose("+ Timed out waiting on locks (attempt %d); will retry" % attempt)
+                time.sleep(get_cut_over_backoff_seconds(attempt))
+    finally:
+        act_query("SET SESSION lock_wait_timeout = %d" % original_lock_wait_timeout)
+
+
+def drop_swap_tables():
+    """
+    Drop the original table, then rename the ghost table in its place. Child tables' foreign keys
+    reference the table by name, and so apply to the new table without being rebuilt.
+    The table does not exist in between the two statements. Once the original table is dropped,
+    the ghost table holds the only copy of the data: the RENAME is retried right away until it
+    succeeds, and the ghost table is never cleaned up.
+    """
+    act_query("SET SESSION foreign_key_checks = 0")
+    try:
+        query = "DROP TABLE %s.%s" % (database_name, original_table_name)
+        act_query(query)
+        cut_over_status["original_table_dropped"] = True
+        query = "RENAME /* %s */ TABLE %s.%s TO %s.%s" % (get_cut_over_marker(),
+            database_name, ghost_table_name, database_name, original_table_name)
+        while True:
+            try:
+                act_query(query)
+                break
+            except MySQLdb.OperationalError, err:
+                # 1205: Lock wait timeout exceeded
+                if err.args[0] != 1205:
+                    raise
+                verbose("+ Rename timed out waiting on locks; retrying")
+    finally:
+        act_query("SET SESSION foreign_key_checks = 1")
+    verbose("Table %s.%s has been dropped, and table %s.%s has been renamed to %s.%s" % (database_name, original_table_name, database_name, ghost_table_name, database_name, original_table_name))
+
+
 def table_exists(check_table_name):
     """
     See if the a given table exists:
@@ -349,6 +630,81 @@ def alter_ghost_table():
     verbose("Table %s.%s has been altered" % (database_name, ghost_table_name))
 
 
+def get_secondary_keys_definitions(read_table_name):
+    """
+    Return (key name, ADD KEY clause) for the non-unique keys of the given table.
+    Unique keys are never deferred, as these affect which rows are copied.
+    Functional keys are left in place, as are FULLTEXT and SPATIAL keys, which cannot be
+    built online (LOCK=NONE).
+    """
+    query = """
+        SELECT *
+        FROM INFORMATION_SCHEMA.STATISTICS
+        WHERE TABLE_SCHEMA='%s'
+            AND TABLE_NAME='%s'
+            AND NON_UNIQUE=1
+        ORDER BY INDEX_NAME, SEQ_IN_INDEX
+        """ % (database_name, read_table_name)
+    keys_rows = {}
+    keys_names = []
+    for row in get_rows(query):
+        if row["INDEX_NAME"] not in keys_rows:
+            keys_names.append(row["INDEX_NAME"])
+            keys_rows[row["INDEX_NAME"]] = []
+        keys_rows[row["INDEX_NAME"]].append(row)
+
+    secondary_keys_definitions = []
+    for key_name in keys_names:
+        key_rows = keys_rows[key_name]
+        if [key_row for key_row in key_rows if key_row.get("EXPRESSION")]:
+            continue
+        if key_rows[0]["INDEX_TYPE"] in ["FULLTEXT", "SPATIAL"]:
+            continue
+        key_columns = []
+        for key_row in key_rows:
+            key_column = "`%s`" % key_row["COLUMN_NAME"]
+            if key_row["SUB_PART"]:
+                key_column += "(%d)" % int(key_row["SUB_PART"])
+            if key_row["COLLATION"] == "D":
+                key_column += " DESC"
+            key_columns.append(key_column)
+        secondary_keys_definitions.append((key_name, "ADD KEY `%s` (%s)" % (key_name, ", ".join(key_columns)),))
+    return secondary_keys_definitions
+
+
+def defer_secondary_keys():
+    """
+    Drop the non-unique keys from the (still empty) ghost table, so that the copy only
+    maintains the unique keys. Return the ADD KEY clauses with which to restore them.
+    """
+    secondary_keys_definitions = get_secondary_keys_definitions(ghost_table_name)
+    if not secondary_keys_definitions:
+        verbose("No secondary keys to defer")
+        return []
+    query = "ALTER TABLE %s.%s %s" % (database_name, ghost_table_name,
+        ", ".join(["DROP KEY `%s`" % key_name for (key_name, add_key_clause) in secondary_keys_definitions]))
+    act_query(query)
+    verbose("Deferred secondary keys: %s" % ", ".join([key_name for (key_name, add_key_clause) in secondary_keys_definitions]))
+    return [add_key_clause for (key_name, add_key_clause) in secondary_keys_definitions]
+
+
+def add_deferred_secondary_keys():
+    """
+    Build all deferred keys in a single ALTER, which sorts and bulk loads each of them.
+    With triggers, the ghost table is written to by any change to the original table,
+    so the build must allow for concurrent writes (InnoDB online DDL).
+    """
+    if not deferred_keys_clauses:
+        return
+    query = "ALTER TABLE %s.%s %s" % (database_name, ghost_table_name, ", ".join(deferred_keys_clauses))
+    if options.capture == "triggers":
+        query += ", ALGORITHM=INPLACE, LOCK=NONE"
+    verbose("Adding deferred secondary keys")
+    add_keys_start_time = time.time()
+    act_query(query)
+    verbose("Deferred secondary keys added in %s seconds" % round(time.time() - add_keys_start_time, 1))
+
+
 def get_table_columns(read_table_name):
     """
     Return the list of column names (lowercase) for the given table
@@ -378,14 +734,18 @@ def get_shared_columns():
     return shared_columns
 
 
+def get_lock_tables_write_query():
+    return """
+        LOCK TABLES %s.%s WRITE, %s.%s WRITE
+        """ % (database_name, original_table_name, database_name, ghost_table_name)
+
+
 def lock_tables_write():
     """
     Lock the original and ghost tables in WRITE mode.
     This can fail due to InnoDB deadlocks, so we keep trying endlessly until it succeeds.
     """
-    query = """
-        LOCK TABLES %s.%s WRITE, %s.%s WRITE
-        """ % (database_name, original_table_name, database_name, ghost_table_name)
+    query = get_lock_tables_write_query()
     verbose("Attempting to lock tables")
     lock_succeeded = False
     while not lock_succeeded:
@@ -497,6 +857,387 @@ def drop_custom_triggers():
     drop_custom_trigger(after_insert_trigger_name)
 
 
+def get_table_columns_data_types(read_table_name):
+    """
+    Return the list of (column name (lowercase), data type) for the given table, by ordinal position
+    """
+    query = """
+        SELECT COLUMN_NAME, DATA_TYPE
+        FROM INFORMATION_SCHEMA.COLUMNS
+        WHERE TABLE_SCHEMA='%s'
+            AND TABLE_NAME='%s'
+        ORDER BY ORDINAL_POSITION
+        """ % (database_name, read_table_name)
+    return [(row["COLUMN_NAME"].lower(), row["DATA_TYPE"].lower()) for row in get_rows(query)]
+
+
+def validate_binlog_capture_possible():
+    """
+    Binlog capture requires row based binary logs with full row images: with partial images,
+    captured rows would lack columns. Cut-over renames tables while they are write locked,
+    which requires MySQL 8.0.13 or later.
+    Return an error message, or None if binlog capture is possible.
+    """
+    row = get_row("SELECT @@global.log_bin AS log_bin, @@global.binlog_format AS binlog_format, @@global.binlog_row_image AS binlog_row_image, VERSION() AS version")
+    if not int(row["log_bin"]) or row["binlog_format"].upper() != "ROW":
+        return "--capture=binlog requires binary logging with binlog_format=ROW"
+    if row["binlog_row_image"].upper() != "FULL":
+        return "--capture=binlog requires binlog_row_image=FULL"
+    if not is_rename_under_lock_tables_supported(row["version"]):
+        return "--capture=binlog requires MySQL 8.0.13 or later, where tables can be renamed while locked"
+    return None
+
+
+def is_rename_under_lock_tables_supported(version):
+    if "mariadb" in version.lower():
+        return False
+    version_numbers = [int(token) for token in re.findall("\d+", version.split("-")[0])[:3]]
+    return version_numbers >= [8, 0, 13]
+
+
+def get_binlog_capture_lag_bytes():
+    """
+    Return number of binary log bytes written beyond the position applied by binlog capture
+    """
+    applied_binlog_file, applied_binlog_position = binlog_capture_status["position"]
+    cursor = conn.cursor()
+    cursor.execute("SHOW BINARY LOGS")
+    binary_logs = cursor.fetchall()
+    cursor.close()
+    return sum([int(row[1]) for row in binary_logs if row[0] >= applied_binlog_file]) - applied_binlog_position
+
+
+def get_master_status(connection=None):
+    """
+    Return the current binary log (file, position)
+    """
+    if connection is None:
+        connection = conn
+    cursor = connection.cursor(MySQLdb.cursors.DictCursor)
+    cursor.execute("SHOW MASTER STATUS")
+    row = cursor.fetchone()
+    cursor.close()
+    return (row["File"], int(row["Position"]),)
+
+
+def get_binary_logs_from(binlog_file, connection):
+    """
+    Return names of binary logs, starting with given one
+    """
+    cursor = connection.cursor()
+    cursor.execute("SHOW BINARY LOGS")
+    binary_logs = [row[0] for row in cursor.fetchall()]
+    cursor.close()
+    return [binary_log for binary_log in binary_logs if binary_log >= binlog_file]
+
+
+def get_mysqlbinlog_command(binlog_file, binlog_position, connection):
+    """
+    The mysqlbinlog command reading (and decoding) row events from given position onwards.
+    Binary logs are read from the server, or from --binlog-dir on the local host.
+    """
+    command = [options.mysqlbinlog]
+    if options.defaults_file:
+        command.append("--defaults-file=%s" % options.defaults_file)
+    command.extend(["--verbose", "--base64-output=DECODE-ROWS", "--start-position=%d" % binlog_position])
+    if options.binlog_dir:
+        command.extend([os.path.join(options.binlog_dir, file_name) for file_name in get_binary_logs_from(binlog_file, connection)])
+    else:
+        command.append("--read-from-remote-server")
+        command.append("--to-last-log")
+        if not options.defaults_file:
+            command.extend(["--host=%s" % options.host, "--port=%d" % options.port, "--user=%s" % options.user])
+            if options.host == "localhost":
+                command.append("--socket=%s" % options.socket)
+        command.append(binlog_file)
+    return command
+
+
+def read_binlog(binlog_file, binlog_position, connection):
+    """
+    Run mysqlbinlog and return its output lines
+    """
+    environment = dict(os.environ)
+    if not options.defaults_file:
+        # Avoid exposing the password on the command line
+        environment["MYSQL_PWD"] = get_password()
+    process = subprocess.Popen(get_mysqlbinlog_command(binlog_file, binlog_position, connection), stdout=subprocess.PIPE, stderr=subprocess.PIPE, env=environment)
+    output, error_output = process.communicate()
+    if process.returncode != 0:
+        raise Exception("mysqlbinlog failed: %s" % error_output.strip())
+    return output.splitlines()
+
+
+def parse_binlog_output(output_lines, binlog_file):
+    """
+    Parse mysqlbinlog --verbose output into complete transactions.
+    Return a list of (row events, binlog file, binlog end position) for each transaction.
+    Row events only refer to the original table; each is (event type, before values, after values),
+    values being a dict of column ordinal position mapped to the value text, as printed by mysqlbinlog.
+    Events outside transactions (rotation, DDL) are listed as transactions with no row events.
+    """
+    row_event_regexp = re.compile("^### (INSERT INTO|UPDATE|DELETE FROM) `?([^`.]+)`?\.`?([^`]+?)`?\s*$")
+    row_value_regexp = re.compile("^###\s+@(\d+)=(.*)$")
+    end_log_pos_regexp = re.compile("end_log_pos (\d+)")
+    xid_regexp = re.compile("Xid = \d+")
+    rotate_regexp = re.compile("Rotate to (\S+)\s+pos: (\d+)")
+
+    transactions = []
+    transaction_row_events = []
+    row_event = None
+    row_values = None
+    event_end_position = None
+    in_transaction = False
+    for line in output_lines:
+        if line.startswith("###"):
+            row_event_match = row_event_regexp.match(line)
+            if row_event_match:
+                event_type = row_event_match.group(1).split()[0].lower()
+                row_event = None
+                if (row_event_match.group(2), row_event_match.group(3)) == (database_name, original_table_name):
+                    row_event = (event_type, {}, {})
+                    transaction_row_events.append(row_event)
+                    row_values = row_event[2]
+            elif row_event is None:
+                continue
+            elif line.strip() == "### WHERE":
+                row_values = row_event[1]
+            elif line.strip() == "### SET":
+                row_values = row_event[2]
+            else:
+                row_value_match = row_value_regexp.match(line)
+                if row_value_match:
+                    row_values[int(row_value_match.group(1))] = row_value_match.group(2)
+            continue
+        if line.startswith("#"):
+            rotate_match = rotate_regexp.search(line)
+            if rotate_match:
+                binlog_file = rotate_match.group(1)
+                transactions.append(([], binlog_file, int(rotate_match.group(2)),))
+                continue
+            end_log_pos_match = end_log_pos_regexp.search(line)
+            if end_log_pos_match:
+                event_end_position = int(end_log_pos_match.group(1))
+            if xid_regexp.search(line):
+                transactions.append((transaction_row_events, binlog_file, event_end_position,))
+                transaction_row_events = []
+                in_transaction = False
+            continue
+        if line == "BEGIN":
+            in_transaction = True
+            continue
+        if line.startswith("COMMIT"):
+            if in_transaction:
+                # Non transactional tables (transactional ones end with Xid)
+                transactions.append((transaction_row_events, binlog_file, event_end_position,))
+                transaction_row_events = []
+                in_transaction = False
+            continue
+    if not in_transaction and event_end_position is not None:
+        # Trailing events outside any transaction
+        transactions.append(([], binlog_file, event_end_position,))
+    return transactions
+
+
+def get_binlog_value_literal(value_text, data_type):
+    """
+    Convert a value, as printed by mysqlbinlog --verbose, into an SQL literal
+    """
+    value_text = value_text.strip()
+    if value_text == "NULL":
+        return "NULL"
+    if value_text.startswith("'") and value_text.endswith("'"):
+        # mysqlbinlog escapes quotes, backslashes and control characters as \xNN.
+        # Hex literals keep the bytes as they are, whatever the character set.
+        raw_value = re.sub("\\\\x([0-9a-fA-F]{2})", lambda match: chr(int(match.group(1), 16)), value_text[1:-1])
+        if not raw_value:
+            return "''"
+        return "X'%s'" % raw_value.encode("hex")
+    unsigned_match = re.match("^-?[0-9]+ \(([0-9]+)\)$", value_text)
+    if unsigned_match:
+        return unsigned_match.group(1)
+    if data_type == "timestamp" and re.match("^[0-9]+([.][0-9]+)?$", value_text):
+        # TIMESTAMP values are printed as seconds since the epoch, possibly fractional
+        if float(value_text) == 0:
+            return "'0000-00-00 00:00:00'"
+        return "FROM_UNIXTIME(%s)" % value_text
+    return value_text
+
+
+def get_binlog_values_literals(values, column_names):
+    """
+    Given row event values (by ordinal position), return the SQL literals for given columns
+    """
+    column_ordinals = binlog_capture_status["column_ordinals"]
+    column_data_types = binlog_capture_status["column_data_types"]
+    return [get_binlog_value_literal(values[column_ordinals[column_name]], column_data_types[column_name]) for column_name in column_names]
+
+
+def coalesce_binlog_row_events(transactions):
+    """
+    Reduce the row events of given transactions into the final state of each affected
+    unique key: either the row's latest values, or None for a deleted row.
+    Return the list of (unique key literals, values), ordered by first appearance of the key.
+    """
+    unique_keys = []
+    unique_keys_states = {}
+    for (row_events, binlog_file, binlog_position) in transactions:
+        for (event_type, before_values, after_values) in row_events:
+            row_states = []
+            if event_type in ["delete", "update"]:
+                # An UPDATE may modify the unique key itself, in which case the old row is gone
+                row_states.append((tuple(get_binlog_values_literals(before_values, unique_key_column_names_list)), None,))
+            if event_type in ["insert", "update"]:
+                row_states.append((tuple(get_binlog_values_literals(after_values, unique_key_column_names_list)), after_values,))
+            for (unique_key_literals, values) in row_states:
+                if unique_key_literals not in unique_keys_states:
+                    unique_keys.append(unique_key_literals)
+                unique_keys_states[unique_key_literals] = values
+    return [(unique_key_literals, unique_keys_states[unique_key_literals]) for unique_key_literals in unique_keys]
+
+
+def get_binlog_batch_queries(unique_keys_states, target_table_name):
+    """
+    Return multi-row DELETE and REPLACE queries, applying the final states of unique keys
+    onto the target table, in batches of --binlog-batch-size rows.
+    """
+    deleted_unique_keys = [unique_key_literals for (unique_key_literals, values) in unique_keys_states if values is None]
+    replaced_values = [values for (unique_key_literals, values) in unique_keys_states if values is not None]
+    shared_columns_list = list(shared_columns)
+
+    queries = []
+    for i in range(0, len(deleted_unique_keys), options.binlog_batch_size):
+        batch_unique_keys = deleted_unique_keys[i:i+options.binlog_batch_size]
+        queries.append("DELETE FROM %s.%s WHERE %s" % (database_name, target_table_name,
+            " OR ".join([get_multiple_columns_equality(unique_key_column_names_list, unique_key_literals) for unique_key_literals in batch_unique_keys])))
+    for i in range(0, len(replaced_values), options.binlog_batch_size):
+        batch_values = replaced_values[i:i+options.binlog_batch_size]
+        queries.append("REPLACE INTO %s.%s (%s) VALUES %s" % (database_name, target_table_name,
+            ", ".join(["`%s`" % column_name for column_name in shared_columns_list]),
+            ", ".join(["(%s)" % ", ".join(get_binlog_values_literals(values, shared_columns_list)) for values in batch_values])))
+    return queries
+
+
+def apply_binlog_transactions(transactions, target_table_name, connection):
+    """
+    Apply captured transactions onto the target table. Changes are coalesced per unique key,
+    and written in multi-row statements, committed at once.
+    Return number of row events applied and number of rows written.
+    """
+    num_row_events = sum([len(row_events) for (row_events, binlog_file, binlog_position) in transactions])
+    unique_keys_states = coalesce_binlog_row_events(transactions)
+    cursor = connection.cursor()
+    for query in get_binlog_batch_queries(unique_keys_states, target_table_name):
+        cursor.execute(query)
+    cursor.close()
+    connection.commit()
+    return num_row_events, len(unique_keys_states)
+
+
+def poll_binlog_changes(target_table_name, connection):
+    """
+    Read binary logs from the last applied position, and apply changes to the original table
+    onto the target table. Only complete transactions are applied.
+    """
+    binlog_file, binlog_position = binlog_capture_status["position"]
+    output_lines = read_binlog(binlog_file, binlog_position, connection)
+    transactions = parse_binlog_output(output_lines, binlog_file)
+    transactions = [transaction for transaction in transactions if transaction[2] is not None]
+    if transactions:
+        num_row_events, num_rows_written = apply_binlog_transactions(transactions, target_table_name, connection)
+        binlog_capture_status["num_row_events"] += num_row_events
+        binlog_capture_status["num_rows_written"] += num_rows_written
+        binlog_capture_status["position"] = (transactions[-1][1], transactions[-1][2],)
+
+
+def capture_binlog_changes():
+    """
+    Background thread: continuously apply changes from the binary logs onto the ghost table,
+    until asked to stop.
+    """
+    connection = None
+    try:
+        try:
+            # Changes to the ghost table are binary logged, as with triggers, so that replicas
+            # end up with the same altered table
+            connection = open_connection()
+            while not binlog_capture_status["stop"]:
+                poll_binlog_changes(ghost_table_name, connection)
+                # Changes accumulated during this interval are coalesced
+                time.sleep(options.binlog_apply_interval/1000.0)
+        except Exception, err:
+            binlog_capture_status["error"] = err
+    finally:
+        if connection:
+            connection.close()
+
+
+def start_binlog_capture():
+    """
+    Start capturing changes from current binary log position. To be called while
+    the original table is write locked, along with reading the unique key range.
+    """
+    original_columns = get_table_columns_data_types(original_table_name)
+    binlog_capture_status["column_ordinals"] = dict([(column_name, i+1) for (i, (column_name, data_type)) in enumerate(original_columns)])
+    binlog_capture_status["column_data_types"] = dict(original_columns)
+    binlog_capture_status["position"] = get_master_status()
+    verbose("Capturing changes from binary log %s:%d" % binlog_capture_status["position"])
+    capture = threading.Thread(target=capture_binlog_changes)
+    capture.setDaemon(True)
+    binlog_capture_status["thread"] = capture
+    capture.start()
+
+
+def stop_binlog_capture():
+    binlog_capture_status["stop"] = True
+    binlog_capture_status["thread"].join()
+    check_binlog_capture()
+
+
+def check_binlog_capture():
+    """
+    Raise an error if binlog capture has failed
+    """
+    if binlog_capture_status.get("error"):
+        raise Exception("Binlog capture failed: %s" % binlog_capture_status["error"])
+
+
+def drain_binlog_changes(target_table_name, target_position):
+    """
+    Synchronously apply binlog changes up to (at least) given (file, position)
+    """
+    while binlog_capture_status["position"] < target_position:
+        poll_binlog_changes(target_table_name, conn)
+    verbose("Applied binlog changes up to %s:%d; %d row events in total, coalesced into %d row writes" % (binlog_capture_status["position"] + (binlog_capture_status["num_row_events"], binlog_capture_status["num_rows_written"],)))
+
+
+def binlog_cut_over():
+    """
+    Swap tables when changes are captured from the binary logs:
+    with tables locked, apply all changes captured so far, then rename, still under lock.
+    No write to the original table can thus go unapplied.
+    """
+    stop_binlog_capture()
+    cut_over(binlog_cut_over_attempt)
+
+
+def binlog_cut_over_attempt():
+    """
+    A single, lock_wait_timeout bounded, attempt at locking, draining and renaming.
+    Changes are first drained unlocked, so as to keep the locked drain short.
+    """
+    drain_binlog_changes(ghost_table_name, get_master_status())
+    drop_table(archive_table_name)
+    act_query(get_lock_tables_write_query())
+    verbose("Tables locked WRITE")
+    try:
+        drain_binlog_changes(ghost_table_name, get_master_status())
+        act_query(get_rename_tables_query())
+        verbose_tables_renamed()
+    finally:
+        unlock_tables()
+
+
 def get_unique_key_min_values_variables():
     return ",".join(["@unique_key_min_value_%d" % i for i in range(0,count_columns_in_unique_key)])
 
@@ -509,10 +1250,131 @@ def get_unique_key_range_start_variables():
 def get_unique_key_range_end_variables():
     return ",".join(["@unique_key_range_end_%d" % i for i in range(0,count_columns_in_unique_key)])
 
+def get_unique_key_range_start_placeholders():
+    return ",".join(["%%(unique_key_range_start_%d)s" % i for i in range(0,count_columns_in_unique_key)])
+
+def get_unique_key_range_end_placeholders():
+    return ",".join(["%%(unique_key_range_end_%d)s" % i for i in range(0,count_columns_in_unique_key)])
+
+def get_unique_key_max_values_placeholders():
+    return ",".join(["%%(unique_key_max_value_%d)s" % i for i in range(0,count_columns_in_unique_key)])
+
+def get_unique_key_range_start_references():
+    """
+    Range start as referenced by the data pass queries: either session variables,
+    or placeholders to be bound on client side chunking.
+    """
+    if options.client_side_chunking:
+        return get_unique_key_range_start_placeholders()
+    return get_unique_key_range_start_variables()
+
+def get_unique_key_range_end_references():
+    if options.client_side_chunking:
+        return get_unique_key_range_end_placeholders()
+    return get_unique_key_range_end_variables()
+
+def get_range_query_args(unique_key_range_start_values, unique_key_range_end_values):
+    """
+    Return the placeholder values for a client side chunking data pass query
+    """
+    query_args = {}
+    for i in range(0,count_columns_in_unique_key):
+        query_args["unique_key_range_start_%d" % i] = unique_key_range_start_values[i]
+        query_args["unique_key_range_end_%d" % i] = unique_key_range_end_values[i]
+    return query_args
+
+
+def create_checkpoint_table():
+    """
+    Create the checkpoint table, holding the last completed range end per data pass.
+    Key columns are created in the likes of the unique key columns.
+    """
+    drop_table(checkpoint_table_name)
+
+    query = """
+        CREATE TABLE %s.%s (
+            oak_checkpoint_id TINYINT UNSIGNED NOT NULL PRIMARY KEY,
+            oak_data_pass VARCHAR(16) NOT NULL,
+            oak_checkpoint_time TIMESTAMP NOT NULL
+        )
+        SELECT %s FROM %s.%s LIMIT 0
+        """ % (database_name, checkpoint_table_name,
+               unique_key_column_names, database_name, original_table_name)
+    act_query(query)
+    verbose("Table %s.%s has been created" % (database_name, checkpoint_table_name))
+
+
+def write_checkpoint(data_pass, query_args=None, connection=None):
+    """
+    Record the current range end of the given data pass as completed
+    """
+    query = """
+        REPLACE INTO %s.%s
+            (oak_checkpoint_id, oak_data_pass, oak_checkpoint_time, %s)
+        VALUES
+            (1, '%s', NOW(), %s)
+        """ % (database_name, checkpoint_table_name, unique_key_column_names,
+               data_pass, get_unique_key_range_end_references())
+    act_query(query, query_args, connection)
+
+
+def read_checkpoint():
+    """
+    Return the data pass and range end values recorded in the checkpoint table,
+    or (None, None) when no chunk has been recorded.
+    """
+    query = """
+        SELECT oak_data_pass, %s
+        FROM %s.%s
+        WHERE oak_checkpoint_id = 1
+        """ % (unique_key_column_names, database_name, checkpoint_table_name)
+    row = get_row_nondict(query)
+    if row is None:
+        return None, None
+    return row[0], tuple(row[1:])
+
+
+def set_unique_key_range_start(unique_key_range_start_values):
+    """
+    Server side chunking: set the range start session variables to given values
+    """
+    query_args = {}
+    for i in range(0,count_columns_in_unique_key):
+        query_args["unique_key_range_start_%d" % i] = unique_key_range_start_values[i]
+    query = "SELECT %s INTO %s" % (get_unique_key_range_start_placeholders(), get_unique_key_range_start_variables())
+    act_query(query, query_args)
+
+
+def get_unique_key_range_client_side():
+    """
+    Return the first and last unique key values in the original table, as read
+    directly into native values (no session variables involved)
+    """
+    unique_key_values = []
+    for order in ["ASC", "DESC"]:
+        query = """
+            SELECT
+              %s
+            FROM %s.%s
+            ORDER BY %s LIMIT 1
+            """ % (unique_key_column_names,
+                   database_name, original_table_name,
+                   ",".join(["%s %s" % (unique_key_column_name, order) for unique_key_column_name in unique_key_column_names_list]))
+        unique_key_values.append(get_row_nondict(query))
+    unique_key_min_values, unique_key_max_values = unique_key_values
+    range_exists = int(unique_key_min_values is not None)
+    verbose("%s (min, max) values: (%s, %s)" % (unique_key_column_names, unique_key_min_values, unique_key_max_values))
+
+    return unique_key_min_values, unique_key_max_values, range_exists
+
+
 def get_unique_key_range():
     """
     Return the first and last unique key values in the original table
     """
+    if options.client_side_chunking:
+        return get_unique_key_range_client_side()
+
     query = """
         SELECT
           %s
@@ -612,12 +1474,14 @@ def get_multiple_columns_non_equality_comparison_by_names(delimited_columns_name
     return get_multiple_columns_non_equality_comparison(columns, values, comparison_sign, include_equality)
 
 
-def set_unique_key_range_end(first_round):
+def set_unique_key_range_end(first_round, chunk_size=None):
     """
     Get the range end: calculate the highest value in the next chunk of rows.
     """
 
-    limit_count = options.chunk_size
+    if chunk_size is None:
+        chunk_size = options.chunk_size
+    limit_count = chunk_size
     if not first_round:
         limit_count += 1
 
@@ -641,24 +1505,60 @@ def set_unique_key_range_end(first_round):
     act_query(query)
 
 
-def set_unique_key_next_range_start():
+def get_unique_key_range_end_values(unique_key_range_start_values, first_round, unique_key_range_max_values=None, connection=None, chunk_size=None):
     """
-    Calculate the starting point of the next range
+    Client side chunking: read the highest value in the next chunk of rows.
+    The range is bounded by unique_key_range_max_values, by default the table's max values.
+    Return None when there are no more rows in range.
     """
-    query = "SELECT %s INTO %s" % (get_unique_key_range_end_variables(), get_unique_key_range_start_variables())
-    act_query(query)
-
-
-def is_range_overflow(first_round):
-    if first_round:
-        return False
-
+    if chunk_size is None:
+        chunk_size = options.chunk_size
+    if unique_key_range_max_values is None:
+        unique_key_range_max_values = unique_key_max_values
     query = """
-        SELECT (%s) >= (%s) AS range_overflow
-        """ % (get_unique_key_range_start_variables(), get_unique_key_max_values_variables())
-    row = get_row(query)
-    range_overflow = int(row["range_overflow"])
-    return range_overflow
+        SELECT %s
+        FROM (SELECT %s FROM %s.%s
+          WHERE
+                %s
+            AND
+                %s
+          ORDER BY %s LIMIT %d) SEL1
+        ORDER BY %s LIMIT 1
+        """ % (unique_key_column_names,
+               unique_key_column_names, database_name, original_table_name,
+               get_multiple_columns_non_equality_comparison_by_names(unique_key_column_names, get_unique_key_range_start_placeholders(), ">", first_round),
+               get_multiple_columns_non_equality_comparison_by_names(unique_key_column_names, get_unique_key_max_values_placeholders(), "<", True),
+               ",".join(["%s ASC" % unique_key_column_name for unique_key_column_name in unique_key_column_names_list]), chunk_size,
+               ",".join(["%s DESC" % unique_key_column_name for unique_key_column_name in unique_key_column_names_list]))
+    query_args = {}
+    for i in range(0,count_columns_in_unique_key):
+        query_args["unique_key_range_start_%d" % i] = unique_key_range_start_values[i]
+        query_args["unique_key_max_value_%d" % i] = unique_key_range_max_values[i]
+    return get_row_nondict(query, query_args, connection)
+
+
+def set_unique_key_next_range_start():
+    """
+    Calculate the starting point of the next range
+    """
+    query = "SELECT %s INTO %s" % (get_unique_key_range_end_variables(), get_unique_key_range_start_variables())
+    act_query(query)
+
+
+def is_range_overflow(first_round, unique_key_range_start_values=None):
+    if first_round:
+        return False
+
+    if options.client_side_chunking:
+        # Range start is the previous range end, as read from the table itself
+        return tuple(unique_key_range_start_values) == tuple(unique_key_max_values)
+
+    query = """
+        SELECT (%s) >= (%s) AS range_overflow
+        """ % (get_unique_key_range_start_variables(), get_unique_key_max_values_variables())
+    row = get_row(query)
+    range_overflow = int(row["range_overflow"])
+    return range_overflow
 
 
 def is_range_degenerated():
@@ -673,6 +1573,103 @@ def is_range_degenerated():
     return range_degenerated
 
 
+def get_seconds_diff(value1, value2):
+    """
+    Return the number of seconds from value1 to value2, which are either
+    datetime/date or timedelta (TIME columns) values
+    """
+    delta = value2 - value1
+    return delta.days*86400 + delta.seconds
+
+
+def get_ratio_complete(unique_key_range_start_values):
+    """
+    Return the ratio of range already worked, or None if this cannot be computed
+    for the unique key type
+    """
+    if unique_key_type not in ["integer", "temporal"]:
+        return None
+    if options.client_side_chunking:
+        min_value = unique_key_min_values[0]
+        max_value = unique_key_max_values[0]
+        start_value = unique_key_range_start_values[0]
+        if unique_key_type == "integer":
+            if max_value == min_value:
+                return 1.0
+            return float(start_value - min_value)/(max_value - min_value)
+        total_seconds = get_seconds_diff(min_value, max_value)
+        if not total_seconds:
+            return 1.0
+        return float(get_seconds_diff(min_value, start_value))/total_seconds
+
+    if unique_key_type == "integer":
+        ratio_complete_query = """
+            SELECT
+                IFNULL((@unique_key_range_start_0-@unique_key_min_value_0)/
+                (@unique_key_max_value_0-@unique_key_min_value_0), 1)
+                AS ratio_complete
+            """
+    else:
+        ratio_complete_query = """
+            SELECT
+                IFNULL(TIMESTAMPDIFF(SECOND, @unique_key_min_value_0, @unique_key_range_start_0)/
+                TIMESTAMPDIFF(SECOND, @unique_key_min_value_0, @unique_key_max_value_0), 1)
+                AS ratio_complete
+            """
+    return float(get_row(ratio_complete_query)["ratio_complete"])
+
+
+def get_rows_ratio_complete(num_walked_rows, estimated_rows):
+    """
+    Return the ratio of rows already walked out of the estimated number of rows.
+    This applies to any unique key type.
+    """
+    if not estimated_rows:
+        return None
+    # Row estimation may be off; we never claim completion before we're done
+    return min(float(num_walked_rows)/estimated_rows, 0.99)
+
+
+def get_range_estimated_rows(unique_key_range_start_values, unique_key_range_end_values=None):
+    """
+    Return the number of rows following given unique key values (up to and including the end
+    values, if given), as estimated by the optimizer's index dives (EXPLAIN), hence cheaply.
+    """
+    if unique_key_range_end_values is None:
+        unique_key_range_end_values = unique_key_max_values
+    query = """
+        EXPLAIN SELECT %s
+        FROM %s.%s FORCE INDEX (%s)
+        WHERE
+                %s
+            AND
+                %s
+        """ % (unique_key_column_names,
+               database_name, original_table_name, original_table_unique_key_name,
+               get_multiple_columns_non_equality_comparison_by_names(unique_key_column_names, get_unique_key_range_start_placeholders(), ">"),
+               get_multiple_columns_non_equality_comparison_by_names(unique_key_column_names, get_unique_key_range_end_placeholders(), "<", True))
+    query_args = get_range_query_args(unique_key_range_start_values, unique_key_range_end_values)
+    cursor = conn.cursor(MySQLdb.cursors.DictCursor)
+    cursor.execute(query, query_args)
+    row = cursor.fetchone()
+    cursor.close()
+    if not row or row["rows"] is None:
+        return 0
+    return int(row["rows"])
+
+
+def get_data_pass_estimated_rows():
+    """
+    Number of rows a data pass is expected to walk: by INFORMATION_SCHEMA estimation, or,
+    when there is none (e.g. statistics not yet gathered), by actual count.
+    """
+    estimated_rows = get_table_estimated_rows()
+    if not estimated_rows:
+        estimated_rows = int(get_row_nondict("SELECT COUNT(*) FROM %s.%s" % (database_name, original_table_name))[0])
+    verbose("Estimated number of rows: %d" % estimated_rows)
+    return estimated_rows
+
+
 def get_eta_seconds(elapsed_times, ratio_complete):
     if not elapsed_times:
         return 0
@@ -704,17 +1701,222 @@ def get_eta_presentation(eta_seconds, data_valid):
 
 def get_progress_and_eta_presentation(elapsed_times, elapsed_time, ratio_complete):
     elapsed_times.append((elapsed_time, ratio_complete,))
-    elapsed_times = elapsed_times[-5:]
+    # Estimate by the recent samples only
+    del elapsed_times[:-5]
     progress = int(100.0 * ratio_complete)
-    #eta_seconds = get_eta_seconds(elapsed_times, ratio_complete)
-    #return "progress: %d%%, ETA: %s" % (progress, get_eta_presentation(eta_seconds, len(elapsed_times) >= 5))
-    return "progress: %d%%" % progress
+    eta_seconds = get_eta_seconds(elapsed_times, ratio_complete)
+    return "progress: %d%%, ETA: %s" % (progress, get_eta_presentation(eta_seconds, len(elapsed_times) >= 5))
 
 
 def to_string_list(list):
     return ["%s" % val for val in list]
 
 
+def get_adapted_chunk_size(chunk_size, query_execution_time):
+    """
+    Given the execution time of the last chunk, return the size of the next chunk,
+    so as to approach --chunk-time-ms. Adaptation is smoothed, limited to a factor of 2
+    per chunk, and clamped by --min-chunk-size and --max-chunk-size.
+    """
+    if options.chunk_time_ms <= 0:
+        return chunk_size
+
+    target_seconds = options.chunk_time_ms/1000.0
+    if query_execution_time > 0:
+        ratio = target_seconds/query_execution_time
+    else:
+        ratio = 4.0
+    # Smoothing: only go half the way toward the size computed from last chunk,
+    # then limit the step to a factor of 2 either way
+    factor = max(0.5, min((1.0 + ratio)/2, 2.0))
+    adapted_chunk_size = int(chunk_size*factor)
+    return max(options.min_chunk_size, min(adapted_chunk_size, options.max_chunk_size))
+
+
+def get_replicas_hosts_and_ports():
+    """
+    Parse --replicas into a list of (host, port)
+    """
+    replicas_hosts_and_ports = []
+    for replica in options.replicas.split(","):
+        replica = replica.strip()
+        if not replica:
+            continue
+        replica_tokens = replica.split(":")
+        replica_port = 3306
+        if len(replica_tokens) == 2:
+            replica_port = int(replica_tokens[1])
+        replicas_hosts_and_ports.append((replica_tokens[0], replica_port,))
+    return replicas_hosts_and_ports
+
+
+def get_replica_lag_seconds(replica_connection):
+    """
+    Return the replica's Seconds_Behind_Master, or None when replication is not running
+    """
+    cursor = replica_connection.cursor(MySQLdb.cursors.DictCursor)
+    cursor.execute("SHOW SLAVE STATUS")
+    slave_status = cursor.fetchone()
+    cursor.close()
+    if slave_status is None:
+        return None
+    seconds_behind_master_value = slave_status["Seconds_Behind_Master"]
+    if seconds_behind_master_value is None:
+        return None
+    return int(seconds_behind_master_value)
+
+
+def monitor_replication_lag(replicas_hosts_and_ports):
+    """
+    Background thread: continuously poll replicas for their lag, and publish
+    the most lagging one in replication_lag_status.
+    A replica which cannot be read, or is not replicating, is considered to be lagging.
+    """
+    replicas_connections = {}
+    while True:
+        max_lag = 0
+        lagging_replica = None
+        for (replica_host, replica_port,) in replicas_hosts_and_ports:
+            replica = "%s:%d" % (replica_host, replica_port)
+            try:
+                if replica not in replicas_connections:
+                    replicas_connections[replica] = open_replica_connection(replica_host, replica_port)
+                replica_lag = get_replica_lag_seconds(replicas_connections[replica])
+            except Exception, err:
+                replica_lag = None
+                if replica in replicas_connections:
+                    try:
+                        replicas_connections[replica].close()
+                    except:
+                        pass
+                    del replicas_connections[replica]
+            if replica_lag is None:
+                # Unknown lag: assume the worst
+                max_lag, lagging_replica = None, replica
+                break
+            if replica_lag > max_lag:
+                max_lag, lagging_replica = replica_lag, replica
+        replication_lag_status["max_lag"] = max_lag
+        replication_lag_status["lagging_replica"] = lagging_replica
+        time.sleep(1)
+
+
+def start_replication_lag_monitor():
+    replicas_hosts_and_ports = get_replicas_hosts_and_ports()
+    verbose("Monitoring replication lag on %s" % ", ".join(["%s:%d" % replica_host_and_port for replica_host_and_port in replicas_hosts_and_ports]))
+    # Assume the worst until first poll
+    replication_lag_status["max_lag"] = None
+    replication_lag_status["lagging_replica"] = None
+    monitor = threading.Thread(target=monitor_replication_lag, args=(replicas_hosts_and_ports,))
+    monitor.setDaemon(True)
+    monitor.start()
+
+
+def parse_load_thresholds(load_thresholds_description):
+    """
+    Parse a 'Threads_running=50,Innodb_row_lock_current_waits=10' description into
+    a dict of (lowercase) status variable names mapped to thresholds
+    """
+    load_thresholds = {}
+    for load_threshold in load_thresholds_description.split(","):
+        load_threshold = load_threshold.strip()
+        if not load_threshold:
+            continue
+        load_threshold_tokens = load_threshold.split("=")
+        if len(load_threshold_tokens) != 2:
+            raise Exception("Invalid load threshold: %s. Expected format is status_name=threshold" % load_threshold)
+        status_name, threshold = load_threshold_tokens
+        load_thresholds[status_name.strip().lower()] = float(threshold)
+    return load_thresholds
+
+
+def get_global_status(status_names, connection=None):
+    """
+    Return the values of given global status variables, read in a single query,
+    as a dict mapping lowercase status names to numeric values.
+    """
+    if connection is None:
+        connection = conn
+    query = """
+        SHOW GLOBAL STATUS WHERE Variable_name IN (%s)
+        """ % ", ".join(["'%s'" % status_name for status_name in status_names])
+    cursor = connection.cursor()
+    cursor.execute(query)
+    rows = cursor.fetchall()
+    cursor.close()
+    global_status = {}
+    for (status_name, status_value) in rows:
+        global_status[status_name.lower()] = float(status_value)
+    return global_status
+
+
+def get_exceeded_load(load_thresholds, global_status):
+    """
+    Return a description of the first status variable exceeding its threshold, or None
+    """
+    for status_name in load_thresholds:
+        if status_name in global_status and global_status[status_name] > load_thresholds[status_name]:
+            return "%s=%d (threshold: %d)" % (status_name, global_status[status_name], load_thresholds[status_name])
+    return None
+
+
+def get_load_throttle_reason(connection=None):
+    """
+    Check server load against --max-load; return a description if exceeded, or None.
+    Raise an error if --critical-load is exceeded.
+    """
+    if not (max_load_thresholds or critical_load_thresholds):
+        return None
+    status_names = set(max_load_thresholds.keys()).union(critical_load_thresholds.keys())
+    global_status = get_global_status(status_names, connection)
+    exceeded_load = get_exceeded_load(critical_load_thresholds, global_status)
+    if exceeded_load:
+        raise Exception("Critical load reached: %s" % exceeded_load)
+    exceeded_load = get_exceeded_load(max_load_thresholds, global_status)
+    if exceeded_load:
+        return "load is %s" % exceeded_load
+    return None
+
+
+def is_replication_lagging():
+    if not options.max_lag:
+        return False
+    max_lag = replication_lag_status["max_lag"]
+    if max_lag is None:
+        return True
+    return max_lag > options.max_lag
+
+
+def get_replication_lag_throttle_reason():
+    if not is_replication_lagging():
+        return None
+    lagging_replica = replication_lag_status["lagging_replica"]
+    if lagging_replica is None:
+        return "replication lag is unknown"
+    return "replica %s lag is %s seconds" % (lagging_replica, replication_lag_status["max_lag"])
+
+
+def throttle(connection=None):
+    """
+    Block while replicas lag beyond --max-lag, or while server load exceeds --max-load.
+    Return number of seconds throttled.
+    """
+    throttle_start_time = None
+    while True:
+        throttle_reason = get_replication_lag_throttle_reason() or get_load_throttle_reason(connection)
+        if not throttle_reason:
+            break
+        if throttle_start_time is None:
+            throttle_start_time = time.time()
+            verbose("+ Throttling: %s" % throttle_reason)
+        time.sleep(0.5)
+    if throttle_start_time is None:
+        return 0
+    throttle_time = time.time() - throttle_start_time
+    verbose("+ Throttled for %s seconds" % round(throttle_time, 1))
+    return throttle_time
+
+
 def sleep_after_chunk(query_execution_time):
     sleep_seconds = None
     if options.sleep_millis > 0:
@@ -724,95 +1926,757 @@ def sleep_after_chunk(query_execution_time):
     if sleep_seconds:
         verbose("+ Will sleep for %s seconds" % round(sleep_seconds, 2))
         time.sleep(sleep_seconds)
+        return sleep_seconds
+    return 0
+
+
+def get_latency_histogram_bounds():
+    """
+    Upper bounds (seconds) of chunk latency histogram buckets: 1ms through 100s in a 1-2-5 series.
+    The last bucket is unbounded.
+    """
+    bounds = []
+    for power in range(-3, 3):
+        for factor in [1, 2, 5]:
+            bounds.append(factor * (10.0 ** power))
+    return bounds
+
+
+def get_percentile(sorted_values, percentile):
+    if not sorted_values:
+        return 0
+    index = int(round(percentile/100.0 * (len(sorted_values)-1)))
+    return sorted_values[index]
+
+
+def get_histogram_percentile(histogram, bounds, percentile):
+    """
+    Return the upper bound of the bucket in which given percentile falls
+    """
+    total_count = sum(histogram)
+    if not total_count:
+        return 0
+    accumulated_count = 0
+    for (i, count) in enumerate(histogram):
+        accumulated_count += count
+        if accumulated_count >= percentile/100.0 * total_count:
+            if i < len(bounds):
+                return bounds[i]
+            return None
+    return None
+
+
+def start_data_pass_metrics(description):
+    """
+    Create and register metrics for a data pass. Recent chunks are kept in a
+    fixed size ring buffer; latency of all chunks is kept in a histogram.
+    """
+    data_pass_metrics = {
+        "description": description,
+        "start_time": time.time(),
+        "end_time": None,
+        "recent_chunks": deque(maxlen=1000),
+        "num_chunks": 0,
+        "num_rows": 0,
+        "num_retries": 0,
+        "query_time": 0.0,
+        "sleep_time": 0.0,
+        "throttle_time": 0.0,
+        "max_query_time": 0.0,
+        "latency_histogram": [0] * (len(get_latency_histogram_bounds()) + 1),
+        }
+    data_passes_metrics.append(data_pass_metrics)
+    return data_pass_metrics
+
+
+def record_chunk_metrics(data_pass_metrics, num_rows, query_execution_time, sleep_time, throttle_time, num_attempts):
+    metrics_lock.acquire()
+    try:
+        rows_per_second = 0
+        if query_execution_time > 0:
+            rows_per_second = num_rows/query_execution_time
+        data_pass_metrics["recent_chunks"].append({
+            "rows": num_rows,
+            "query_time": query_execution_time,
+            "sleep_time": sleep_time,
+            "throttle_time": throttle_time,
+            "retries": num_attempts - 1,
+            "rows_per_second": rows_per_second,
+            })
+        data_pass_metrics["num_chunks"] += 1
+        data_pass_metrics["num_rows"] += num_rows
+        data_pass_metrics["num_retries"] += num_attempts - 1
+        data_pass_metrics["query_time"] += query_execution_time
+        data_pass_metrics["sleep_time"] += sleep_time
+        data_pass_metrics["throttle_time"] += throttle_time
+        data_pass_metrics["max_query_time"] = max(data_pass_metrics["max_query_time"], query_execution_time)
+        bounds = get_latency_histogram_bounds()
+        bucket = len(bounds)
+        for (i, bound) in enumerate(bounds):
+            if query_execution_time <= bound:
+                bucket = i
+                break
+        data_pass_metrics["latency_histogram"][bucket] += 1
+    finally:
+        metrics_lock.release()
+
+
+def get_recent_chunks_presentation(data_pass_metrics):
+    """
+    Rolling latency percentiles and throughput, over the recent chunks
+    """
+    metrics_lock.acquire()
+    try:
+        recent_chunks = list(data_pass_metrics["recent_chunks"])
+    finally:
+        metrics_lock.release()
+    if not recent_chunks:
+        return "no chunks"
+    query_times = sorted([chunk["query_time"] for chunk in recent_chunks])
+    total_rows = sum([chunk["rows"] for chunk in recent_chunks])
+    total_query_time = sum(query_times)
+    rows_per_second = 0
+    if total_query_time > 0:
+        rows_per_second = total_rows/total_query_time
+    return "last %d chunks latency p50/p95/p99: %s/%s/%s seconds, %d rows/sec" % (
+        len(recent_chunks),
+        round(get_percentile(query_times, 50), 3), round(get_percentile(query_times, 95), 3), round(get_percentile(query_times, 99), 3),
+        rows_per_second)
+
+
+def get_data_pass_summary(data_pass_metrics):
+    end_time = data_pass_metrics["end_time"] or time.time()
+    elapsed_time = end_time - data_pass_metrics["start_time"]
+    bounds = get_latency_histogram_bounds()
+    histogram = data_pass_metrics["latency_histogram"]
+    rows_per_second = 0
+    if elapsed_time > 0:
+        rows_per_second = data_pass_metrics["num_rows"]/elapsed_time
+    return {
+        "description": data_pass_metrics["description"],
+        "completed": data_pass_metrics["end_time"] is not None,
+        "elapsed_seconds": elapsed_time,
+        "num_chunks": data_pass_metrics["num_chunks"],
+        "num_rows": data_pass_metrics["num_rows"],
+        "num_retries": data_pass_metrics["num_retries"],
+        "query_seconds": data_pass_metrics["query_time"],
+        "sleep_seconds": data_pass_metrics["sleep_time"],
+        "throttle_seconds": data_pass_metrics["throttle_time"],
+        "rows_per_second": rows_per_second,
+        "latency_seconds": {
+            "p50": get_histogram_percentile(histogram, bounds, 50),
+            "p95": get_histogram_percentile(histogram, bounds, 95),
+            "p99": get_histogram_percentile(histogram, bounds, 99),
+            "max": data_pass_metrics["max_query_time"],
+            },
+        "latency_histogram": [{"le": bound, "count": count} for (bound, count) in zip(bounds + [None], histogram)],
+        }
+
+
+def write_summary_file(status):
+    """
+    Write the data passes summary, in JSON format, to --summary-file
+    """
+    if not options.summary_file:
+        return
+    summary = {
+        "database": database_name,
+        "table": original_table_name,
+        "alter": options.alter_statement,
+        "status": status,
+        "chunk_size": options.chunk_size,
+        "data_passes": [get_data_pass_summary(data_pass_metrics) for data_pass_metrics in data_passes_metrics],
+        }
+    if cut_over_status:
+        summary["cut_over"] = cut_over_status
+    if options.verify:
+        summary["verification"] = verification_status
+    if estimate_results:
+        summary["estimate"] = estimate_results
+    summary_file = open(options.summary_file, "w")
+    try:
+        json.dump(summary, summary_file, indent=2)
+    finally:
+        summary_file.close()
+    verbose("Summary written to %s" % options.summary_file)
 
 
-def act_data_pass(first_data_pass_query, rest_data_pass_query, description):
+def get_prepared_statement(query, connection):
+    """
+    Prepare the given query on the given connection, once per connection.
+    Range session variables become parameters.
+    Return the statement name and the names of session variables to execute it with,
+    or None if the query cannot be prepared.
+    """
+    prepared_statements_lock.acquire()
+    try:
+        connection_prepared_statements = prepared_statements.setdefault(id(connection), {})
+    finally:
+        prepared_statements_lock.release()
+    if query not in connection_prepared_statements:
+        parameter_regexp = "@(unique_key_[a-z_]+_[0-9]+)"
+        parameter_names = re.findall(parameter_regexp, query)
+        statement_text = re.sub(parameter_regexp, "?", query)
+        statement_name = "oak_data_pass_%d" % len(connection_prepared_statements)
+        try:
+            act_query("SET @oak_statement_text = %s", (statement_text,), connection)
+            act_query("PREPARE %s FROM @oak_statement_text" % statement_name, connection=connection)
+            connection_prepared_statements[query] = (statement_name, parameter_names,)
+        except MySQLdb.Error, err:
+            verbose("+ Cannot prepare data pass query (%s); executing as plain query" % err)
+            connection_prepared_statements[query] = None
+    return connection_prepared_statements[query]
+
+
+def forget_prepared_statements(connection):
+    """
+    Prepared statements die with their connection
+    """
+    prepared_statements_lock.acquire()
+    try:
+        prepared_statements.pop(id(connection), None)
+    finally:
+        prepared_statements_lock.release()
+
+
+def act_prepared_query(query, query_args=None, connection=None):
+    """
+    Execute the given data pass query as a server side prepared statement, such that it is
+    only parsed once.
+    With client side chunking, range values are sent inline with the query text instead:
+    binding them to a prepared statement would take an extra round trip per chunk.
+    """
+    if connection is None:
+        connection = conn
+    if query_args is not None:
+        return act_query(query, query_args, connection)
+    prepared_statement = get_prepared_statement(query, connection)
+    if prepared_statement is None:
+        return act_query(query, query_args, connection)
+    statement_name, parameter_names = prepared_statement
+    if not parameter_names:
+        return act_query("EXECUTE %s" % statement_name, connection=connection)
+    return act_query("EXECUTE %s USING %s" % (statement_name, ", ".join(["@%s" % parameter_name for parameter_name in parameter_names])), connection=connection)
+
+
+def act_data_pass_query(query, query_args=None, connection=None):
+    if options.skip_prepared_statements:
+        return act_query(query, query_args, connection)
+    return act_prepared_query(query, query_args, connection)
+
+
+def execute_data_pass_chunk(execute_data_pass_query, query_args=None, connection=None, act_chunk_function=act_data_pass_query):
+    """
+    Execute a single chunk's data pass query, retrying on failure (deadlock, lock wait timeout)
+    up to --max-lock-retries times. The chunk is acted upon by act_chunk_function, which returns
+    the number of affected rows.
+    Return number of affected rows, execution time, number of attempts and whether the chunk succeeded.
+    """
+    num_affected_rows = 0
+    query_execution_time = 0
+    num_attempts = 0
+    chunk_succeeded = False
+    retry_data_pass = True
+    while retry_data_pass:
+        try:
+            query_start_time = time.time()
+            num_attempts += 1
+            num_affected_rows = act_chunk_function(execute_data_pass_query, query_args, connection)
+            query_execution_time = (time.time() - query_start_time)
+            chunk_succeeded = True
+            retry_data_pass = False
+        except Exception, err:
+            print_error("Failed chunk: %s" % err)
+            sleep_after_chunk(1)
+        if (num_attempts >= options.max_lock_retries) and (options.max_lock_retries > 0):
+            retry_data_pass = False
+        if retry_data_pass:
+            verbose("Retrying same chunk %s/%s" % (num_attempts, options.max_lock_retries))
+    return num_affected_rows, query_execution_time, num_attempts, chunk_succeeded
+
+
+def act_data_pass(first_data_pass_query, rest_data_pass_query, description, data_pass, resume_range_start_values=None, act_chunk_function=act_data_pass_query):
+    """
+    Work the unique key range in chunks. When resume_range_start_values is given,
+    the range is worked from just after these values.
+    Each chunk is acted upon by act_chunk_function (by default: execute the data pass query).
+    """
     # Is there any range to work with, at all?
     if not range_exists:
         return
 
-    query = """
-        SELECT %s INTO %s
-        """ % (get_unique_key_min_values_variables(), get_unique_key_range_start_variables())
-    act_query(query)
+    unique_key_range_start_values = None
+    first_round = True
+    if resume_range_start_values is not None:
+        verbose("%s: resuming after (%s)" % (description, ",".join(to_string_list(resume_range_start_values))))
+        unique_key_range_start_values = resume_range_start_values
+        first_round = False
+        if not options.client_side_chunking:
+            set_unique_key_range_start(resume_range_start_values)
+    elif options.client_side_chunking:
+        unique_key_range_start_values = unique_key_min_values
+    else:
+        query = """
+            SELECT %s INTO %s
+            """ % (get_unique_key_min_values_variables(), get_unique_key_range_start_variables())
+        act_query(query)
 
     start_time = time.time()
     elapsed_times = []
+    data_pass_metrics = start_data_pass_metrics(description)
 
     total_num_affected_rows = 0
-    first_round = True
     total_num_attempts = 0
-    while not is_range_overflow(first_round):
+    chunk_size = options.chunk_size
+    # With keys whose range does not tell the progress, progress is told by rows
+    estimated_rows = None
+    num_walked_rows = 0
+    if unique_key_type not in ["integer", "temporal"]:
+        estimated_rows = get_data_pass_estimated_rows()
+        if resume_range_start_values is not None:
+            num_walked_rows = max(estimated_rows - get_range_estimated_rows(resume_range_start_values), 0)
+    while not is_range_overflow(first_round, unique_key_range_start_values):
+        check_binlog_capture()
+        throttle_time = throttle()
         if first_round:
             execute_data_pass_query = first_data_pass_query
         else:
             execute_data_pass_query = rest_data_pass_query
         elapsed_time = time.time() - start_time
 
-        set_unique_key_range_end(first_round)
+        query_args = None
+        if options.client_side_chunking:
+            unique_key_range_end_values = get_unique_key_range_end_values(unique_key_range_start_values, first_round, chunk_size=chunk_size)
+            if unique_key_range_end_values is None:
+                break
+            query_args = get_range_query_args(unique_key_range_start_values, unique_key_range_end_values)
+        else:
+            set_unique_key_range_end(first_round, chunk_size)
+            unique_key_range_start_values = [get_session_variable_value("unique_key_range_start_%d" % i) for i in range(0,count_columns_in_unique_key)]
+            unique_key_range_end_values = [get_session_variable_value("unique_key_range_end_%d" % i) for i in range(0,count_columns_in_unique_key)]
         first_round = False
 
-        unique_key_range_start_values = [get_session_variable_value("unique_key_range_start_%d" % i) for i in range(0,count_columns_in_unique_key)]
-        unique_key_range_end_values = [get_session_variable_value("unique_key_range_end_%d" % i) for i in range(0,count_columns_in_unique_key)]
-
         if total_num_attempts % 20 == 0:
             verbose("- Reminder: altering %s.%s: %s..." % (database_name, original_table_name, options.alter_statement[0:30])) 
-        if unique_key_type == "integer":
-            ratio_complete_query = """
-                SELECT
-                    IFNULL((@unique_key_range_start_0-@unique_key_min_value_0)/
-                    (@unique_key_max_value_0-@unique_key_min_value_0), 1)
-                    AS ratio_complete
-                """
-            ratio_complete = float(get_row(ratio_complete_query)["ratio_complete"])
-            verbose("%s range (%s), (%s), %s" % (description, ",".join(to_string_list(unique_key_range_start_values)), ",".join(to_string_list(unique_key_range_end_values)), get_progress_and_eta_presentation(elapsed_times, elapsed_time, ratio_complete)))
+            if data_pass_metrics["num_chunks"]:
+                verbose("- %s" % get_recent_chunks_presentation(data_pass_metrics))
+        ratio_complete = get_ratio_complete(unique_key_range_start_values)
+        if ratio_complete is None and estimated_rows:
+            ratio_complete = get_rows_ratio_complete(num_walked_rows, estimated_rows)
+        if ratio_complete is None:
+            verbose("%s range (%s), (%s), progress: N/A" % (description, ",".join(to_string_list(unique_key_range_start_values)), ",".join(to_string_list(unique_key_range_end_values))))
         elif unique_key_type == "temporal":
-            ratio_complete_query = """
-                SELECT
-                    IFNULL(TIMESTAMPDIFF(SECOND, @unique_key_min_value_0, @unique_key_range_start_0)/
-                    TIMESTAMPDIFF(SECOND, @unique_key_min_value_0, @unique_key_max_value_0), 1)
-                    AS ratio_complete
-                """
-            ratio_complete = float(get_row(ratio_complete_query)["ratio_complete"])
-            verbose("%s range ('%s', '%s'), %s" % (description, ",".join(unique_key_range_start_values), ",".join(unique_key_range_end_values), get_progress_and_eta_presentation(elapsed_times, elapsed_time, ratio_complete)))
+            verbose("%s range ('%s', '%s'), %s" % (description, ",".join(to_string_list(unique_key_range_start_values)), ",".join(to_string_list(unique_key_range_end_values)), get_progress_and_eta_presentation(elapsed_times, elapsed_time, ratio_complete)))
         else:
-            verbose("%s range (%s), (%s), progress: N/A" % (description, ",".join(unique_key_range_start_values), ",".join(unique_key_range_end_values)))
+            verbose("%s range (%s), (%s), %s" % (description, ",".join(to_string_list(unique_key_range_start_values)), ",".join(to_string_list(unique_key_range_end_values)), get_progress_and_eta_presentation(elapsed_times, elapsed_time, ratio_complete)))
 
         if options.lock_chunks:
             lock_tables_read()
             
-        retry_data_pass = True
-        num_attempts = 0
-        query_execution_time = 0
-        while retry_data_pass:
-            try:
-                query_start_time = time.time()
-                total_num_attempts += 1
-                num_affected_rows = act_query(execute_data_pass_query)
-                total_num_affected_rows += num_affected_rows
-                query_execution_time = (time.time() - query_start_time)
-                retry_data_pass = False
-            except Exception, err:
-                print_error("Failed chunk: %s" % err)
-                sleep_after_chunk(1)
-                num_attempts += 1
-            if (num_attempts >= options.max_lock_retries) and (options.max_lock_retries > 0):
-                retry_data_pass = False
-            if retry_data_pass:
-                verbose("Retrying same chunk %s/%s" % (num_attempts, options.max_lock_retries))
+        num_affected_rows, query_execution_time, num_attempts, chunk_succeeded = execute_data_pass_chunk(execute_data_pass_query, query_args, act_chunk_function=act_chunk_function)
+        total_num_attempts += num_attempts
+        total_num_affected_rows += num_affected_rows
+        if estimated_rows:
+            # A chunk's end is found by walking chunk_size rows; only the last chunk may hold fewer
+            if tuple(unique_key_range_end_values) == tuple(unique_key_max_values):
+                num_walked_rows += num_affected_rows
+            else:
+                num_walked_rows += chunk_size
+        if chunk_succeeded:
+            adapted_chunk_size = get_adapted_chunk_size(chunk_size, query_execution_time)
+            if adapted_chunk_size != chunk_size:
+                verbose("+ Chunk took %s seconds; chunk size adapted to %d" % (round(query_execution_time, 3), adapted_chunk_size))
+            chunk_size = adapted_chunk_size
 
         if options.lock_chunks:
             unlock_tables()
 
-        if is_range_degenerated():
-            break
-        
-        set_unique_key_next_range_start()
+        if options.checkpoint:
+            if not chunk_succeeded:
+                # Recording any later chunk would have a resumed run skip this one
+                exit_with_error("%s range (%s), (%s) failed after %d attempts" % (description, ",".join(to_string_list(unique_key_range_start_values)), ",".join(to_string_list(unique_key_range_end_values)), num_attempts))
+            write_checkpoint(data_pass, query_args)
+
+        if options.client_side_chunking:
+            unique_key_range_start_values = unique_key_range_end_values
+        else:
+            if is_range_degenerated():
+                break
+            set_unique_key_next_range_start()
 
-        sleep_after_chunk(query_execution_time)
+        sleep_time = sleep_after_chunk(query_execution_time)
+        record_chunk_metrics(data_pass_metrics, num_affected_rows, query_execution_time, sleep_time, throttle_time, num_attempts)
+    data_pass_metrics["end_time"] = time.time()
     verbose("%s range 100%% complete. Number of rows: %s" % (description, total_num_affected_rows))
 
 
+def get_unique_key_split_values(num_splits):
+    """
+    Return (up to) num_splits-1 unique key values, by which the range is split into
+    num_splits disjoint sub-ranges of roughly equal size.
+    A single column integer key is split arithmetically; any other key is split by
+    walking the key forward from the previous split value, an estimated share of rows
+    at a time, such that the index is read no more than once.
+    """
+    split_values = []
+    if unique_key_type == "integer" and count_columns_in_unique_key == 1:
+        min_value = unique_key_min_values[0]
+        max_value = unique_key_max_values[0]
+        for i in range(1, num_splits):
+            split_values.append((min_value + (max_value - min_value)*i/num_splits,))
+    else:
+        split_num_rows = max(get_table_estimated_rows()/num_splits, 1)
+        query = """
+            SELECT %s
+            FROM %s.%s FORCE INDEX (%s)
+            WHERE %s
+            ORDER BY %s LIMIT %d, 1
+            """ % (unique_key_column_names,
+                   database_name, original_table_name, original_table_unique_key_name,
+                   get_multiple_columns_non_equality_comparison_by_names(unique_key_column_names, get_unique_key_range_start_placeholders(), ">"),
+                   ",".join(["%s ASC" % unique_key_column_name for unique_key_column_name in unique_key_column_names_list]),
+                   split_num_rows-1)
+        split_value = tuple(unique_key_min_values)
+        for i in range(1, num_splits):
+            query_args = {}
+            for j in range(0,count_columns_in_unique_key):
+                query_args["unique_key_range_start_%d" % j] = split_value[j]
+            row = get_row_nondict(query, query_args)
+            if row is None:
+                break
+            split_value = tuple(row)
+            split_values.append(split_value)
+
+    # Splits may degenerate on small or skewed tables
+    distinct_split_values = []
+    for split_value in split_values:
+        if split_value in distinct_split_values:
+            continue
+        if split_value in [tuple(unique_key_min_values), tuple(unique_key_max_values)]:
+            continue
+        distinct_split_values.append(split_value)
+    return distinct_split_values
+
+
+def get_unique_key_sub_ranges(num_splits):
+    """
+    Return a list of (range start values, include range start, range max values) sub-ranges,
+    together covering the entire unique key range.
+    """
+    split_values = get_unique_key_split_values(num_splits)
+    range_boundaries = [tuple(unique_key_min_values)] + split_values + [tuple(unique_key_max_values)]
+    sub_ranges = []
+    for i in range(0, len(range_boundaries)-1):
+        sub_ranges.append((range_boundaries[i], (i == 0), range_boundaries[i+1],))
+    return sub_ranges
+
+
+def get_rows_progress_presentation(elapsed_time, num_rows, estimated_rows):
+    """
+    Progress and ETA, based on number of rows worked out of the estimated number of rows.
+    """
+    if not estimated_rows:
+        return "progress: N/A"
+    ratio_complete = get_rows_ratio_complete(num_rows, estimated_rows)
+    eta_seconds = 0
+    if ratio_complete > 0:
+        eta_seconds = elapsed_time*(1.0 - ratio_complete)/ratio_complete
+    return "progress: %d%%, ETA: %s" % (int(100.0 * ratio_complete), get_eta_presentation(eta_seconds, ratio_complete > 0))
+
+
+def copy_data_pass_worker(worker_id, first_data_pass_query, rest_data_pass_query, sub_range, description, data_pass_metrics):
+    """
+    Walk a single sub-range of the unique key on a dedicated connection.
+    Progress is accumulated in the shared workers_status.
+    """
+    unique_key_range_start_values, first_round, unique_key_range_max_values = sub_range
+    chunk_size = options.chunk_size
+    connection = None
+    try:
+        try:
+            connection = open_connection()
+            if options.skip_binlog:
+                act_query("SET SESSION SQL_LOG_BIN=0", connection=connection)
+            while True:
+                if workers_status["failed"]:
+                    # Some other worker failed; no point in going on
+                    return
+                check_binlog_capture()
+                throttle_time = throttle(connection)
+                unique_key_range_end_values = get_unique_key_range_end_values(unique_key_range_start_values, first_round, unique_key_range_max_values, connection, chunk_size)
+                if unique_key_range_end_values is None:
+                    break
+                if first_round:
+                    execute_data_pass_query = first_data_pass_query
+                else:
+                    execute_data_pass_query = rest_data_pass_query
+                first_round = False
+
+                query_args = get_range_query_args(unique_key_range_start_values, unique_key_range_end_values)
+                num_affected_rows, query_execution_time, num_attempts, chunk_succeeded = execute_data_pass_chunk(execute_data_pass_query, query_args, connection)
+                if not chunk_succeeded:
+                    print_error("Worker %d: giving up on range (%s), (%s)" % (worker_id, ",".join(to_string_list(unique_key_range_start_values)), ",".join(to_string_list(unique_key_range_end_values))))
+                    workers_status["failed"] = True
+                    return
+                chunk_size = get_adapted_chunk_size(chunk_size, query_execution_time)
+
+                workers_status_lock.acquire()
+                try:
+                    workers_status["num_affected_rows"] += num_affected_rows
+                    total_num_affected_rows = workers_status["num_affected_rows"]
+                finally:
+                    workers_status_lock.release()
+                elapsed_time = time.time() - workers_status["start_time"]
+                verbose("%s range (%s), (%s) [worker %d], %s" % (description, ",".join(to_string_list(unique_key_range_start_values)), ",".join(to_string_list(unique_key_range_end_values)), worker_id, get_rows_progress_presentation(elapsed_time, total_num_affected_rows, workers_status["estimated_rows"])))
+
+                if tuple(unique_key_range_end_values) == tuple(unique_key_range_max_values):
+                    record_chunk_metrics(data_pass_metrics, num_affected_rows, query_execution_time, 0, throttle_time, num_attempts)
+                    break
+                unique_key_range_start_values = unique_key_range_end_values
+                sleep_time = sleep_after_chunk(query_execution_time)
+                record_chunk_metrics(data_pass_metrics, num_affected_rows, query_execution_time, sleep_time, throttle_time, num_attempts)
+        except Exception, err:
+            print_error("Worker %d: %s" % (worker_id, err))
+            workers_status["failed"] = True
+    finally:
+        if connection:
+            forget_prepared_statements(connection)
+            connection.close()
+
+
+def act_parallel_data_pass(first_data_pass_query, rest_data_pass_query, description):
+    """
+    Split the unique key range into disjoint sub-ranges, and work them concurrently,
+    each by a worker thread with its own connection.
+    """
+    global workers_status
+    if not range_exists:
+        return
+
+    sub_ranges = get_unique_key_sub_ranges(options.workers)
+    verbose("%s with %d workers" % (description, len(sub_ranges)))
+    workers_status = {
+        "start_time": time.time(),
+        "estimated_rows": get_table_estimated_rows(),
+        "num_affected_rows": 0,
+        "failed": False,
+        }
+    data_pass_metrics = start_data_pass_metrics(description)
+    workers = []
+    for (worker_id, sub_range) in enumerate(sub_ranges):
+        verbose("- worker %d: (%s), (%s)" % (worker_id, ",".join(to_string_list(sub_range[0])), ",".join(to_string_list(sub_range[2]))))
+        worker = threading.Thread(target=copy_data_pass_worker, args=(worker_id, first_data_pass_query, rest_data_pass_query, sub_range, description, data_pass_metrics,))
+        worker.setDaemon(True)
+        workers.append(worker)
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        # Join with timeout, so as to allow for keyboard interrupts
+        while worker.isAlive():
+            worker.join(1)
+
+    if workers_status["failed"]:
+        exit_with_error("%s failed on one or more workers" % description)
+    data_pass_metrics["end_time"] = time.time()
+    verbose("- %s" % get_recent_chunks_presentation(data_pass_metrics))
+    verbose("%s range 100%% complete. Number of rows: %s" % (description, workers_status["num_affected_rows"]))
+
+
+def is_chunk_planning_supported():
+    """
+    Chunk boundaries are interpolated between sampled key values, which requires a single column integer key
+    """
+    return unique_key_type == "integer" and count_columns_in_unique_key == 1
+
+
+def sample_unique_key_distribution(sample_start_value, sample_end_value, sample_num_rows, samples):
+    """
+    Append (start value, end value, estimated number of rows) samples of the given key sub-range,
+    which excludes its start value, to the samples list.
+    The sub-range is split in halves for as long as it holds more than a chunk of rows,
+    and its rows appear to be unevenly spread.
+    """
+    if sample_num_rows > options.chunk_size and sample_end_value - sample_start_value > 1:
+        middle_value = sample_start_value + (sample_end_value - sample_start_value)/2
+        first_half_num_rows = get_range_estimated_rows((sample_start_value,), (middle_value,))
+        second_half_num_rows = max(sample_num_rows - first_half_num_rows, 0)
+        if abs(first_half_num_rows - second_half_num_rows) > sample_num_rows/4:
+            sample_unique_key_distribution(sample_start_value, middle_value, first_half_num_rows, samples)
+            sample_unique_key_distribution(middle_value, sample_end_value, second_half_num_rows, samples)
+            return
+    samples.append((sample_start_value, sample_end_value, sample_num_rows,))
+
+
+def plan_chunks():
+    """
+    Sample the distribution of the unique key, by the optimizer's estimated number of rows within
+    each of (up to) 100 equal sub-ranges of the key, further split where rows are unevenly spread.
+    Return the list of chunk boundaries, strictly within the key's range, expected to be --chunk-size rows apart.
+    No rows are read: chunks are only as equal as the estimates.
+    """
+    verbose("Planning chunks")
+    min_value = unique_key_min_values[0]
+    max_value = unique_key_max_values[0]
+    num_sub_ranges = min(100, max_value - min_value + 1)
+    samples = []
+    sample_start_value = min_value - 1
+    for i in range(1, num_sub_ranges + 1):
+        sample_end_value = min_value - 1 + (max_value - min_value + 1)*i/num_sub_ranges
+        sample_num_rows = get_range_estimated_rows((sample_start_value,), (sample_end_value,))
+        sample_unique_key_distribution(sample_start_value, sample_end_value, sample_num_rows, samples)
+        sample_start_value = sample_end_value
+
+    chunk_boundaries = []
+    num_sampled_rows = 0
+    next_boundary_num_rows = options.chunk_size
+    for (sample_start_value, sample_end_value, sample_num_rows) in samples:
+        # Rows are assumed to be evenly spread within the sample
+        while sample_num_rows and num_sampled_rows + sample_num_rows >= next_boundary_num_rows:
+            boundary_value = sample_start_value + (sample_end_value - sample_start_value)*(next_boundary_num_rows - num_sampled_rows)/sample_num_rows
+            if min_value < boundary_value < max_value and (not chunk_boundaries or boundary_value > chunk_boundaries[-1][0]):
+                chunk_boundaries.append((boundary_value,))
+            next_boundary_num_rows += options.chunk_size
+        num_sampled_rows += sample_num_rows
+    verbose("Estimated number of rows by %d samples: %d" % (len(samples), num_sampled_rows))
+    return chunk_boundaries
+
+
+def get_chunk_plan():
+    """
+    Return the list of (range start values, include range start, range end values) chunks,
+    together covering the entire unique key range. With --chunk-plan-file, a previously
+    saved plan is used; otherwise chunks are planned and then saved.
+    A saved plan remains valid as the table changes: chunks are bounded by the current min
+    and max values, and planned boundaries merely split the range in between.
+    """
+    if options.chunk_plan_file and os.path.exists(options.chunk_plan_file):
+        chunk_plan_file = open(options.chunk_plan_file)
+        try:
+            chunk_boundaries = [tuple(chunk_boundary) for chunk_boundary in json.load(chunk_plan_file)]
+        finally:
+            chunk_plan_file.close()
+        verbose("Read %d chunk boundaries from %s" % (len(chunk_boundaries), options.chunk_plan_file))
+    else:
+        chunk_boundaries = plan_chunks()
+        if options.chunk_plan_file:
+            chunk_plan_file = open(options.chunk_plan_file, "w")
+            try:
+                json.dump(chunk_boundaries, chunk_plan_file)
+            finally:
+                chunk_plan_file.close()
+            verbose("Chunk plan written to %s" % options.chunk_plan_file)
+    range_boundaries = [tuple(unique_key_min_values)] + chunk_boundaries + [tuple(unique_key_max_values)]
+    chunks = []
+    for i in range(0, len(range_boundaries)-1):
+        chunks.append((range_boundaries[i], (i == 0), range_boundaries[i+1],))
+    verbose("%d chunks planned" % len(chunks))
+    return chunks
+
+
+def planned_data_pass_worker(worker_id, first_data_pass_query, rest_data_pass_query, chunks_queue, description, data_pass, data_pass_metrics, connection=None):
+    """
+    Work planned chunks off the shared queue until it is exhausted. No boundary queries
+    are required, as chunks are known in advance.
+    With a single worker this runs on the main connection; otherwise on a dedicated one.
+    """
+    own_connection = (connection is None)
+    try:
+        try:
+            if own_connection:
+                connection = open_connection()
+                if options.skip_binlog:
+                    act_query("SET SESSION SQL_LOG_BIN=0", connection=connection)
+            while not workers_status["failed"]:
+                try:
+                    unique_key_range_start_values, first_round, unique_key_range_end_values = chunks_queue.get_nowait()
+                except Queue.Empty:
+                    return
+                check_binlog_capture()
+                throttle_time = throttle(connection)
+                if first_round:
+                    execute_data_pass_query = first_data_pass_query
+                else:
+                    execute_data_pass_query = rest_data_pass_query
+                query_args = get_range_query_args(unique_key_range_start_values, unique_key_range_end_values)
+                if options.lock_chunks:
+                    lock_tables_read()
+                num_affected_rows, query_execution_time, num_attempts, chunk_succeeded = execute_data_pass_chunk(execute_data_pass_query, query_args, connection)
+                if options.lock_chunks:
+                    unlock_tables()
+                if not chunk_succeeded:
+                    print_error("Worker %d: giving up on range (%s), (%s)" % (worker_id, ",".join(to_string_list(unique_key_range_start_values)), ",".join(to_string_list(unique_key_range_end_values))))
+                    workers_status["failed"] = True
+                    return
+                if options.checkpoint:
+                    write_checkpoint(data_pass, query_args, connection)
+
+                workers_status_lock.acquire()
+                try:
+                    workers_status["num_affected_rows"] += num_affected_rows
+                    workers_status["num_chunks_done"] += 1
+                    ratio_complete = float(workers_status["num_chunks_done"])/workers_status["num_chunks"]
+                    elapsed_time = time.time() - workers_status["start_time"]
+                    progress_and_eta = get_progress_and_eta_presentation(workers_status["elapsed_times"], elapsed_time, ratio_complete)
+                finally:
+                    workers_status_lock.release()
+                verbose("%s range (%s), (%s) [worker %d], %s" % (description, ",".join(to_string_list(unique_key_range_start_values)), ",".join(to_string_list(unique_key_range_end_values)), worker_id, progress_and_eta))
+
+                sleep_time = sleep_after_chunk(query_execution_time)
+                record_chunk_metrics(data_pass_metrics, num_affected_rows, query_execution_time, sleep_time, throttle_time, num_attempts)
+        except Exception, err:
+            print_error("Worker %d: %s" % (worker_id, err))
+            workers_status["failed"] = True
+    finally:
+        if own_connection and connection:
+            forget_prepared_statements(connection)
+            connection.close()
+
+
+def act_planned_data_pass(first_data_pass_query, rest_data_pass_query, description, data_pass):
+    """
+    Work the planned chunks, by --workers workers, each taking the next chunk off a shared queue.
+    Progress is the ratio of chunks completed.
+    """
+    global workers_status
+    if not range_exists:
+        return
+
+    chunks = get_chunk_plan()
+    chunks_queue = Queue.Queue()
+    for chunk in chunks:
+        chunks_queue.put(chunk)
+    workers_status = {
+        "start_time": time.time(),
+        "num_chunks": len(chunks),
+        "num_chunks_done": 0,
+        "elapsed_times": [],
+        "num_affected_rows": 0,
+        "failed": False,
+        }
+    data_pass_metrics = start_data_pass_metrics(description)
+    if options.workers == 1:
+        planned_data_pass_worker(0, first_data_pass_query, rest_data_pass_query, chunks_queue, description, data_pass, data_pass_metrics, conn)
+    else:
+        verbose("%s with %d workers" % (description, options.workers))
+        workers = []
+        for worker_id in range(0, options.workers):
+            worker = threading.Thread(target=planned_data_pass_worker, args=(worker_id, first_data_pass_query, rest_data_pass_query, chunks_queue, description, data_pass, data_pass_metrics,))
+            worker.setDaemon(True)
+            workers.append(worker)
+        for worker in workers:
+            worker.start()
+        for worker in workers:
+            # Join with timeout, so as to allow for keyboard interrupts
+            while worker.isAlive():
+                worker.join(1)
+
+    if workers_status["failed"]:
+        exit_with_error("%s failed" % description)
+    data_pass_metrics["end_time"] = time.time()
+    verbose("- %s" % get_recent_chunks_presentation(data_pass_metrics))
+    verbose("%s range 100%% complete. Number of rows: %s" % (description, workers_status["num_affected_rows"]))
+
+
 def copy_data_pass():
     shared_columns_listing = ", ".join(["`%s`" % shared_column for shared_column in shared_columns])
     
@@ -834,18 +2698,25 @@ def copy_data_pass():
             %s)
         """ % (database_name, ghost_table_name, shared_columns_listing,
             shared_columns_listing, database_name, original_table_name, original_table_unique_key_name,
-            get_multiple_columns_non_equality_comparison_by_names(unique_key_column_names, get_unique_key_range_start_variables(), ">", first_round),
-            get_multiple_columns_non_equality_comparison_by_names(unique_key_column_names, get_unique_key_range_end_variables(), "<", True),
+            get_multiple_columns_non_equality_comparison_by_names(unique_key_column_names, get_unique_key_range_start_references(), ">", first_round),
+            get_multiple_columns_non_equality_comparison_by_names(unique_key_column_names, get_unique_key_range_end_references(), "<", True),
             engine_flags
             ) for first_round in [True, False]]
     first_data_pass_query = data_pass_queries[0]
     rest_data_pass_query = data_pass_queries[1]
 
-    act_data_pass(first_data_pass_query, rest_data_pass_query, "Copying")
+    if options.plan_chunks and not is_chunk_planning_supported():
+        verbose("Chunks can only be planned on a single column integer key; discovering chunk boundaries as copying")
+        options.plan_chunks = False
+    if options.plan_chunks and get_resume_range_start_values("copy") is None:
+        act_planned_data_pass(first_data_pass_query, rest_data_pass_query, "Copying", "copy")
+    elif options.workers > 1:
+        act_parallel_data_pass(first_data_pass_query, rest_data_pass_query, "Copying")
+    else:
+        act_data_pass(first_data_pass_query, rest_data_pass_query, "Copying", "copy", get_resume_range_start_values("copy"))
 
 
-def delete_data_pass():
-    shared_columns_listing = ", ".join(shared_columns)
+def get_not_in_delete_data_pass_queries():
     data_pass_queries = ["""
         DELETE FROM %s.%s
         WHERE
@@ -860,17 +2731,207 @@ def delete_data_pass():
                 %s)
             )
         """ % (database_name, ghost_table_name,
-            get_multiple_columns_non_equality_comparison_by_names(unique_key_column_names, get_unique_key_range_start_variables(), ">", first_round),
-            get_multiple_columns_non_equality_comparison_by_names(unique_key_column_names, get_unique_key_range_end_variables(), "<", True),
+            get_multiple_columns_non_equality_comparison_by_names(unique_key_column_names, get_unique_key_range_start_references(), ">", first_round),
+            get_multiple_columns_non_equality_comparison_by_names(unique_key_column_names, get_unique_key_range_end_references(), "<", True),
             unique_key_column_names,
             unique_key_column_names, database_name, original_table_name,
-            get_multiple_columns_non_equality_comparison_by_names(unique_key_column_names, get_unique_key_range_start_variables(), ">", first_round),
-            get_multiple_columns_non_equality_comparison_by_names(unique_key_column_names, get_unique_key_range_end_variables(), "<", True)
+            get_multiple_columns_non_equality_comparison_by_names(unique_key_column_names, get_unique_key_range_start_references(), ">", first_round),
+            get_multiple_columns_non_equality_comparison_by_names(unique_key_column_names, get_unique_key_range_end_references(), "<", True)
+            ) for first_round in [True, False]]
+    return data_pass_queries
+
+
+def get_anti_join_delete_data_pass_queries():
+    """
+    Ghost rows in range which have no matching row in the original table are found
+    by a LEFT JOIN on the unique key, avoiding a (possibly dependent) subquery.
+    """
+    ghost_unique_key_column_names = ",".join(["%s.%s.%s" % (database_name, ghost_table_name, unique_key_column_name) for unique_key_column_name in unique_key_column_names_list])
+    join_condition = " AND ".join(["(%s.%s.%s = %s.%s.%s)" % (database_name, ghost_table_name, unique_key_column_name, database_name, original_table_name, unique_key_column_name) for unique_key_column_name in unique_key_column_names_list])
+    data_pass_queries = ["""
+        DELETE %s.%s
+        FROM %s.%s
+            LEFT JOIN %s.%s ON (%s)
+        WHERE
+            (%s
+            AND
+            %s)
+        AND %s.%s.%s IS NULL
+        """ % (database_name, ghost_table_name,
+            database_name, ghost_table_name,
+            database_name, original_table_name, join_condition,
+            get_multiple_columns_non_equality_comparison_by_names(ghost_unique_key_column_names, get_unique_key_range_start_references(), ">", first_round),
+            get_multiple_columns_non_equality_comparison_by_names(ghost_unique_key_column_names, get_unique_key_range_end_references(), "<", True),
+            database_name, original_table_name, unique_key_column_names_list[0]
             ) for first_round in [True, False]]
+    return data_pass_queries
+
+
+def delete_data_pass():
+    if options.delete_pass_method == "anti-join":
+        data_pass_queries = get_anti_join_delete_data_pass_queries()
+    else:
+        data_pass_queries = get_not_in_delete_data_pass_queries()
     first_data_pass_query = data_pass_queries[0]
     rest_data_pass_query = data_pass_queries[1]
 
-    act_data_pass(first_data_pass_query, rest_data_pass_query, "Deleting")
+    act_data_pass(first_data_pass_query, rest_data_pass_query, "Deleting", "delete", get_resume_range_start_values("delete"))
+
+
+def is_delete_pass_required():
+    """
+    Rows deleted from the original table are deleted from the ghost table by the AD trigger.
+    A row can only be orphaned in the ghost table if it is deleted while being copied.
+    With InnoDB (copy reads in LOCK IN SHARE MODE) and MyISAM (INSERT...SELECT locks the table),
+    the copy blocks such deletes until the chunk is committed, hence no orphans.
+    """
+    if options.skip_delete_pass:
+        return False
+    if options.auto_skip_delete_pass and table_engine in ["innodb", "myisam"]:
+        verbose("Table engine is %s; skipping DELETE data pass" % table_engine)
+        return False
+    return True
+
+
+def get_checksum_columns():
+    """
+    Return the shared columns which retain their type (and collation) in the ghost table.
+    Only these are expected to have identical checksums in both tables.
+    """
+    columns_types = []
+    for read_table_name in [original_table_name, ghost_table_name]:
+        query = """
+            SELECT COLUMN_NAME, COLUMN_TYPE, COLLATION_NAME
+            FROM INFORMATION_SCHEMA.COLUMNS
+            WHERE TABLE_SCHEMA='%s'
+                AND TABLE_NAME='%s'
+            """ % (database_name, read_table_name)
+        columns_types.append(dict([(row["COLUMN_NAME"].lower(), (row["COLUMN_TYPE"], row["COLLATION_NAME"],)) for row in get_rows(query)]))
+    original_columns_types, ghost_columns_types = columns_types
+    checksum_columns = [shared_column for shared_column in sorted(shared_columns) if original_columns_types.get(shared_column.lower()) == ghost_columns_types.get(shared_column.lower())]
+    excluded_columns = [shared_column for shared_column in sorted(shared_columns) if shared_column not in checksum_columns]
+    if excluded_columns:
+        verbose("Columns excluded from verification due to changed type: %s" % ", ".join(excluded_columns))
+    return checksum_columns
+
+
+def get_verify_data_pass_queries(checksum_columns):
+    """
+    Return, for first round and for the rest, a tuple of:
+    checksum query on original table, checksum query on ghost table,
+    and the DELETE and INSERT queries re-copying the chunk.
+    """
+    checksum_columns_listing = ", ".join(["`%s`" % checksum_column for checksum_column in checksum_columns])
+    checksum_nulls_listing = ", ".join(["ISNULL(`%s`)" % checksum_column for checksum_column in checksum_columns])
+    shared_columns_listing = ", ".join(["`%s`" % shared_column for shared_column in shared_columns])
+
+    engine_flags = ""
+    if table_engine == "innodb":
+        engine_flags = "LOCK IN SHARE MODE"
+
+    data_pass_queries = []
+    for first_round in [True, False]:
+        range_condition = "(%s AND %s)" % (
+            get_multiple_columns_non_equality_comparison_by_names(unique_key_column_names, get_unique_key_range_start_references(), ">", first_round),
+            get_multiple_columns_non_equality_comparison_by_names(unique_key_column_names, get_unique_key_range_end_references(), "<", True))
+        checksum_queries = ["""
+            SELECT
+                COUNT(*),
+                COALESCE(BIT_XOR(CRC32(CONCAT_WS('#', %s, CONCAT(%s)))), 0)
+            FROM %s.%s
+            WHERE %s
+            %s
+            """ % (checksum_columns_listing, checksum_nulls_listing,
+                   database_name, read_table_name,
+                   range_condition,
+                   engine_flags) for read_table_name in [original_table_name, ghost_table_name]]
+        delete_query = """
+            DELETE FROM %s.%s
+            WHERE %s
+            """ % (database_name, ghost_table_name, range_condition)
+        insert_query = """
+            INSERT IGNORE INTO %s.%s (%s)
+                (SELECT %s FROM %s.%s FORCE INDEX (%s)
+                WHERE %s
+                %s)
+            """ % (database_name, ghost_table_name, shared_columns_listing,
+                   shared_columns_listing, database_name, original_table_name, original_table_unique_key_name,
+                   range_condition,
+                   engine_flags)
+        data_pass_queries.append((checksum_queries[0], checksum_queries[1], delete_query, insert_query,))
+    return data_pass_queries
+
+
+def act_verify_chunk(verify_queries, query_args=None, connection=None):
+    """
+    Compare the chunk's checksum on both tables, within a single transaction. With InnoDB,
+    reads are locking, so triggers cannot change the range in between.
+    On mismatch, re-copy the chunk. Return number of rows re-copied.
+    """
+    if connection is None:
+        connection = conn
+    original_checksum_query, ghost_checksum_query, delete_query, insert_query = verify_queries
+    cursor = connection.cursor()
+    try:
+        cursor.execute(original_checksum_query, query_args)
+        original_checksum = cursor.fetchone()
+        cursor.execute(ghost_checksum_query, query_args)
+        ghost_checksum = cursor.fetchone()
+        num_recopied_rows = 0
+        if tuple(original_checksum) != tuple(ghost_checksum):
+            verification_status["num_mismatched_chunks"] += 1
+            verbose("+ Checksum mismatch: original (%s), ghost (%s); re-copying chunk" % (",".join(to_string_list(original_checksum)), ",".join(to_string_list(ghost_checksum))))
+            cursor.execute(delete_query, query_args)
+            num_recopied_rows = cursor.execute(insert_query, query_args)
+        connection.commit()
+    except:
+        connection.rollback()
+        cursor.close()
+        raise
+    cursor.close()
+    return num_recopied_rows
+
+
+def verify_data_pass():
+    checksum_columns = get_checksum_columns()
+    if not checksum_columns:
+        verbose("No shared columns retain their type; skipping verification")
+        return
+    data_pass_queries = get_verify_data_pass_queries(checksum_columns)
+    first_data_pass_query = data_pass_queries[0]
+    rest_data_pass_query = data_pass_queries[1]
+
+    act_data_pass(first_data_pass_query, rest_data_pass_query, "Verifying", "verify", get_resume_range_start_values("verify"), act_verify_chunk)
+    verbose("Verification found %d mismatched chunks, which have been re-copied" % verification_status["num_mismatched_chunks"])
+
+
+def get_resume_range_start_values(data_pass):
+    """
+    When resuming the given data pass, return the range end values of its last completed chunk
+    """
+    if checkpoint_data_pass == data_pass:
+        return checkpoint_range_end_values
+    return None
+
+
+def validate_resumable():
+    """
+    A resumed run requires the ghost table, custom triggers and checkpoint table of the failed run.
+    """
+    if not table_exists(ghost_table_name):
+        exit_with_error("Cannot resume: ghost table %s.%s does not exist" % (database_name, ghost_table_name))
+    if not table_exists(checkpoint_table_name):
+        exit_with_error("Cannot resume: checkpoint table %s.%s does not exist" % (database_name, checkpoint_table_name))
+    for trigger_name in [after_delete_trigger_name, after_update_trigger_name, after_insert_trigger_name]:
+        if not trigger_exists(trigger_name):
+            exit_with_error("Cannot resume: trigger %s does not exist" % trigger_name)
+
+
+def get_cut_over_marker():
+    """
+    Comment embedded in the RENAME statement, by which it is identified in the processlist and binary logs
+    """
+    return "oak-online-alter-table cut-over %s" % original_table_name
 
 
 def rename_tables():
@@ -878,17 +2939,335 @@ def rename_tables():
     """
 
     drop_table(archive_table_name)
-    query = """
-        RENAME TABLE
+    act_query(get_rename_tables_query())
+    verbose_tables_renamed()
+
+
+def get_rename_tables_query():
+    return """
+        RENAME /* %s */ TABLE
             %s.%s TO %s.%s,
             %s.%s TO %s.%s
-        """ % (database_name, original_table_name, database_name, archive_table_name,
+        """ % (get_cut_over_marker(),
+               database_name, original_table_name, database_name, archive_table_name,
                database_name, ghost_table_name, database_name, original_table_name, )
-    act_query(query)
+
+
+def verbose_tables_renamed():
     verbose("Table %s.%s has been renamed to %s.%s," % (database_name, original_table_name, database_name, archive_table_name))
     verbose("and table %s.%s has been renamed to %s.%s" % (database_name, ghost_table_name, database_name, original_table_name))
 
 
+def get_table_size_statistics():
+    """
+    Return the original table's TABLE_ROWS, AVG_ROW_LENGTH, DATA_LENGTH and INDEX_LENGTH,
+    as estimated by INFORMATION_SCHEMA
+    """
+    query = """
+        SELECT TABLE_ROWS, AVG_ROW_LENGTH, DATA_LENGTH, INDEX_LENGTH
+        FROM INFORMATION_SCHEMA.TABLES
+        WHERE TABLE_SCHEMA='%s'
+            AND TABLE_NAME='%s'
+        """ % (database_name, original_table_name)
+    row = get_row(query)
+    return dict([(column_name, int(row[column_name] or 0)) for column_name in ["TABLE_ROWS", "AVG_ROW_LENGTH", "DATA_LENGTH", "INDEX_LENGTH"]])
+
+
+def sample_chunk(unique_key_range_start_values):
+    """
+    Time a single, read-only, chunk starting at given values: computing the range end,
+    then reading the rows the copy would read.
+    Return the range end values, number of rows read and seconds taken.
+    """
+    shared_columns_listing = ", ".join(["`%s`" % shared_column for shared_column in shared_columns])
+    query_args = None
+    if not options.client_side_chunking:
+        set_unique_key_range_start(unique_key_range_start_values)
+    sample_start_time = time.time()
+    if options.client_side_chunking:
+        unique_key_range_end_values = get_unique_key_range_end_values(unique_key_range_start_values, True)
+        if unique_key_range_end_values is None:
+            return None, 0, 0
+        query_args = get_range_query_args(unique_key_range_start_values, unique_key_range_end_values)
+    else:
+        set_unique_key_range_end(True)
+    query = """
+        SELECT %s FROM %s.%s FORCE INDEX (%s)
+        WHERE
+            (%s
+            AND
+            %s)
+        """ % (shared_columns_listing, database_name, original_table_name, original_table_unique_key_name,
+            get_multiple_columns_non_equality_comparison_by_names(unique_key_column_names, get_unique_key_range_start_references(), ">", True),
+            get_multiple_columns_non_equality_comparison_by_names(unique_key_column_names, get_unique_key_range_end_references(), "<", True))
+    cursor = conn.cursor()
+    num_rows = cursor.execute(query, query_args)
+    cursor.fetchall()
+    cursor.close()
+    sample_time = time.time() - sample_start_time
+    if not options.client_side_chunking:
+        unique_key_range_end_values = [get_session_variable_value("unique_key_range_end_%d" % i) for i in range(0,count_columns_in_unique_key)]
+    return unique_key_range_end_values, num_rows, sample_time
+
+
+def sample_chunks():
+    """
+    Sample --estimate-samples chunks. A single column integer key is sampled at evenly spread
+    points along its range; other keys cannot be cheaply positioned, and are sampled by
+    consecutive chunks from the range start.
+    Return total number of rows read and total seconds taken.
+    """
+    total_num_rows = 0
+    total_sample_time = 0
+    if unique_key_type == "integer" and count_columns_in_unique_key == 1:
+        samples_start_values = [tuple(unique_key_min_values)] + get_unique_key_split_values(options.estimate_samples)
+        for unique_key_range_start_values in samples_start_values:
+            unique_key_range_end_values, num_rows, sample_time = sample_chunk(unique_key_range_start_values)
+            total_num_rows += num_rows
+            total_sample_time += sample_time
+    else:
+        unique_key_range_start_values = unique_key_min_values
+        for i in range(0, options.estimate_samples):
+            unique_key_range_end_values, num_rows, sample_time = sample_chunk(unique_key_range_start_values)
+            if unique_key_range_end_values is None:
+                break
+            total_num_rows += num_rows
+            total_sample_time += sample_time
+            if tuple(unique_key_range_end_values) == tuple(unique_key_max_values):
+                break
+            unique_key_range_start_values = unique_key_range_end_values
+    return total_num_rows, total_sample_time
+
+
+def estimate():
+    """
+    Project the cost of the ALTER, without altering anything: number of rows and chunks,
+    duration (by sampled chunks, under chunk size and sleep settings; throttling excluded),
+    bytes written and binary log volume.
+    """
+    table_statistics = get_table_size_statistics()
+    estimated_rows = table_statistics["TABLE_ROWS"]
+    verbose("Table %s.%s: ~%d rows, average row length %d bytes, data length %d bytes, index length %d bytes" % (database_name, original_table_name,
+        estimated_rows, table_statistics["AVG_ROW_LENGTH"], table_statistics["DATA_LENGTH"], table_statistics["INDEX_LENGTH"]))
+
+    sampled_rows, sampled_seconds = 0, 0
+    if range_exists:
+        sampled_rows, sampled_seconds = sample_chunks()
+    rows_per_second = 0
+    if sampled_seconds > 0:
+        rows_per_second = sampled_rows/sampled_seconds
+    verbose("Sampled %d rows in %s seconds" % (sampled_rows, round(sampled_seconds, 3)))
+
+    chunk_size = options.chunk_size
+    if options.chunk_time_ms > 0 and rows_per_second > 0:
+        chunk_size = int(max(options.min_chunk_size, min(rows_per_second*options.chunk_time_ms/1000, options.max_chunk_size)))
+    num_chunks = (estimated_rows + chunk_size - 1)/chunk_size
+
+    # Each data pass walks the entire range
+    data_passes = ["copy"]
+    if is_delete_pass_required():
+        data_passes.append("delete")
+    if options.verify:
+        data_passes.append("verify")
+    query_seconds = 0
+    if rows_per_second > 0:
+        query_seconds = estimated_rows/rows_per_second
+    data_passes_seconds = 0
+    for data_pass in data_passes:
+        data_pass_seconds = query_seconds
+        if options.sleep_millis > 0:
+            data_pass_seconds += num_chunks*options.sleep_millis/1000.0
+        elif options.sleep_ratio > 0:
+            data_pass_seconds += options.sleep_ratio*query_seconds
+        if data_pass == "copy":
+            data_pass_seconds /= options.workers
+        data_passes_seconds += data_pass_seconds
+
+    bytes_written = table_statistics["DATA_LENGTH"] + table_statistics["INDEX_LENGTH"]
+    binlog_bytes = 0
+    row = get_row("SELECT @@global.log_bin AS log_bin, @@session.binlog_format AS binlog_format")
+    if int(row["log_bin"]) and not options.skip_binlog:
+        if row["binlog_format"].upper() == "ROW":
+            # Full row images of all copied rows
+            binlog_bytes = estimated_rows*table_statistics["AVG_ROW_LENGTH"]
+        else:
+            # One INSERT...SELECT statement per chunk
+            binlog_bytes = num_chunks*1024
+
+    estimate_results.update({
+        "estimated_rows": estimated_rows,
+        "chunk_size": chunk_size,
+        "num_chunks": num_chunks,
+        "data_passes": data_passes,
+        "sampled_rows": sampled_rows,
+        "sampled_seconds": sampled_seconds,
+        "rows_per_second": rows_per_second,
+        "estimated_seconds": data_passes_seconds,
+        "estimated_bytes_written": bytes_written,
+        "estimated_binlog_bytes": binlog_bytes,
+        })
+    verbose("Estimate: %d chunks of %d rows; data passes: %s" % (num_chunks, chunk_size, ", ".join(data_passes)))
+    verbose("Estimate: duration %s (excluding throttling and concurrent load)" % get_eta_presentation(data_passes_seconds, rows_per_second > 0))
+    verbose("Estimate: ~%d MB written to ghost table, ~%d MB binary logs" % (bytes_written/(1024*1024), binlog_bytes/(1024*1024)))
+
+
+def signal_cut_over(signal_number, frame):
+    postponed_cut_over_status["signaled"] = True
+
+
+def signal_terminate(signal_number, frame):
+    """
+    On SIGTERM (e.g. a --tables batch being stopped), exit the way any error does,
+    so that triggers are not left behind
+    """
+    exit_with_error("Terminated by signal %d" % signal_number)
+
+
+def is_cut_over_postponed():
+    """
+    Cut-over is postponed until either SIGUSR1 is received or --cut-over-flag-file exists
+    """
+    if postponed_cut_over_status["signaled"]:
+        return False
+    if options.cut_over_flag_file and os.path.exists(options.cut_over_flag_file):
+        return False
+    return True
+
+
+def get_sync_lag_presentation():
+    if options.capture == "binlog":
+        check_binlog_capture()
+        sync_lag = "%d binlog bytes behind" % get_binlog_capture_lag_bytes()
+    else:
+        sync_lag = "in sync via triggers"
+    if options.max_lag:
+        sync_lag = "%s; %s" % (sync_lag, get_replication_lag_throttle_reason() or "replicas lag %s seconds" % replication_lag_status["max_lag"])
+    return sync_lag
+
+
+def wait_for_cut_over():
+    """
+    With --postpone-cut-over, keep the ghost table in sync and wait for the operator's go:
+    either a SIGUSR1 to this process, or creation of --cut-over-flag-file.
+    """
+    signal.signal(signal.SIGUSR1, signal_cut_over)
+    if options.cut_over_flag_file:
+        verbose("Cut-over postponed. Create %s or send SIGUSR1 to process %d to proceed" % (options.cut_over_flag_file, os.getpid()))
+    else:
+        verbose("Cut-over postponed. Send SIGUSR1 to process %d to proceed" % os.getpid())
+    wait_start_time = time.time()
+    last_report_time = 0
+    last_keepalive_time = time.time()
+    while is_cut_over_postponed():
+        if time.time() - last_report_time >= options.postponed_cut_over_report_interval:
+            last_report_time = time.time()
+            verbose("Cut-over postponed for %d seconds; %s" % (int(time.time() - wait_start_time), get_sync_lag_presentation()))
+        if time.time() - last_keepalive_time >= 10:
+            # Keep the connection from reaching wait_timeout. Not a reconnecting ping,
+            # which would lose session settings (e.g. SQL_LOG_BIN)
+            last_keepalive_time = time.time()
+            get_row("SELECT 1")
+        time.sleep(0.2)
+    verbose("Proceeding to cut-over after %d seconds" % int(time.time() - wait_start_time))
+
+
+def get_metadata_locks_instrumented():
+    """
+    Is performance_schema instrumenting metadata locks, so that lock owners of
+    the original table can be told?
+    """
+    try:
+        query = """
+            SELECT COUNT(*) FROM performance_schema.setup_instruments
+            WHERE NAME = 'wait/lock/metadata/sql/mdl' AND ENABLED = 'YES'
+            """
+        return get_row_nondict(query)[0] > 0
+    except Exception:
+        return False
+
+
+def get_long_running_transactions():
+    """
+    Return (thread id, seconds) of transactions open for longer than --cut-over-long-trx-seconds.
+    Where metadata locks are instrumented, only transactions holding locks on the original table
+    are listed; otherwise any long running transaction is suspect.
+    """
+    query = """
+        SELECT trx_mysql_thread_id, TIMESTAMPDIFF(SECOND, trx_started, NOW())
+        FROM INFORMATION_SCHEMA.INNODB_TRX
+        WHERE
+            trx_started < NOW() - INTERVAL %d SECOND
+            AND trx_mysql_thread_id != CONNECTION_ID()
+        """ % options.cut_over_long_trx_seconds
+    if metadata_locks_instrumented:
+        query += """
+            AND trx_mysql_thread_id IN (
+                SELECT threads.PROCESSLIST_ID
+                FROM performance_schema.metadata_locks
+                    JOIN performance_schema.threads ON (metadata_locks.OWNER_THREAD_ID = threads.THREAD_ID)
+                WHERE metadata_locks.OBJECT_SCHEMA = '%s' AND metadata_locks.OBJECT_NAME = '%s'
+            )
+            """ % (database_name, original_table_name)
+    cursor = conn.cursor()
+    cursor.execute(query)
+    rows = cursor.fetchall()
+    cursor.close()
+    return [(int(thread_id), int(trx_seconds)) for (thread_id, trx_seconds) in rows]
+
+
+def get_cut_over_backoff_seconds(attempt):
+    return min(2 ** (attempt - 1), 30)
+
+
+def cut_over(cut_over_attempt_function):
+    """
+    Perform the cut-over with a short lock_wait_timeout, so that the table is never blocked
+    for longer than --cut-over-lock-timeout while waiting on metadata locks.
+    Attempts are postponed while long running transactions may hold locks on the table,
+    and are retried with backoff upon lock wait timeout, in rounds of --cut-over-retries attempts.
+    Between rounds the ghost table is kept in sync. Once --cut-over-rounds rounds fail, so does the cut-over.
+    The reported unavailable time includes the time timed out attempts blocked the table.
+    """
+    original_lock_wait_timeout = get_row_nondict("SELECT @@session.lock_wait_timeout")[0]
+    act_query("SET SESSION lock_wait_timeout = %d" % options.cut_over_lock_timeout)
+    cut_over_status["attempts"] = 0
+    cut_over_status["unavailable_seconds"] = 0
+    try:
+        cut_over_round = 0
+        while True:
+            cut_over_round += 1
+            for attempt in range(1, options.cut_over_retries + 1):
+                long_running_transactions = get_long_running_transactions()
+                if long_running_transactions:
+                    verbose("Postponing cut-over attempt %d/%d; long running transactions: %s" % (attempt, options.cut_over_retries,
+                        ", ".join(["thread %d (%ds)" % (thread_id, trx_seconds) for (thread_id, trx_seconds) in long_running_transactions])))
+                else:
+                    verbose("Cut-over attempt %d/%d" % (attempt, options.cut_over_retries))
+                    cut_over_status["attempts"] += 1
+                    attempt_start_time = time.time()
+                    try:
+                        cut_over_attempt_function()
+                        cut_over_status["unavailable_seconds"] = round(cut_over_status["unavailable_seconds"] + time.time() - attempt_start_time, 3)
+                        verbose("Cut-over completed; table was unavailable for %.3f seconds in total" % cut_over_status["unavailable_seconds"])
+                        return
+                    except MySQLdb.OperationalError, err:
+                        # 1205: Lock wait timeout exceeded
+                        if err.args[0] != 1205:
+                            raise
+                        attempt_seconds = time.time() - attempt_start_time
+                        cut_over_status["unavailable_seconds"] = round(cut_over_status["unavailable_seconds"] + attempt_seconds, 3)
+                        verbose("Cut-over attempt %d/%d timed out after %.3f seconds waiting on locks" % (attempt, options.cut_over_retries, attempt_seconds))
+                if attempt < options.cut_over_retries:
+                    time.sleep(get_cut_over_backoff_seconds(attempt))
+            if cut_over_round == options.cut_over_rounds:
+                raise Exception("Cut-over failed after %d rounds of %d attempts" % (cut_over_round, options.cut_over_retries))
+            backoff_seconds = get_cut_over_backoff_seconds(options.cut_over_retries)
+            print_error("Cut-over did not complete in %d attempts. Keeping ghost table in sync; will begin another round in %d seconds" % (options.cut_over_retries, backoff_seconds))
+            time.sleep(backoff_seconds)
+    finally:
+        act_query("SET SESSION lock_wait_timeout = %d" % original_lock_wait_timeout)
+
+
 def cleanup():
     """
     Remove any data this utility may have created during this runtime or previous runtime.
@@ -896,25 +3275,309 @@ def cleanup():
     if conn:
         unlock_tables()
         drop_custom_triggers()
-        if not options.ghost:
+        if cut_over_status.get("original_table_dropped"):
+            print_error("Table %s.%s has been dropped. Keeping %s.%s, which holds its data: rename it to %s.%s" % (database_name, original_table_name, database_name, ghost_table_name, database_name, original_table_name))
+        elif not options.ghost:
             drop_table(ghost_table_name)
-        drop_table(archive_table_name)
+        if cut_over_status.get("pending_child_foreign_keys"):
+            # Child tables still reference the archive table, which cannot be dropped
+            print_error("Keeping %s.%s, still referenced by child tables. Rebuild their foreign keys with:" % (database_name, archive_table_name))
+            print_error("SET SESSION foreign_key_checks = 0;")
+            for foreign_key in cut_over_status["pending_child_foreign_keys"]:
+                print_error("%s;" % get_rebuild_child_foreign_key_query(foreign_key))
+            print_error("SET SESSION foreign_key_checks = 1;")
+            print_error("then drop %s.%s" % (database_name, archive_table_name))
+        else:
+            drop_table(archive_table_name)
+        drop_table(checkpoint_table_name)
+
+
+def get_batch_tables():
+    """
+    Resolve --tables into a list of (database name, table name). Each comma delimited entry
+    is a table name or a LIKE pattern, optionally qualified by database name.
+    Tables created by this utility are never included.
+    """
+    batch_tables = []
+    for table_entry in [table_entry.strip() for table_entry in options.tables.split(",") if table_entry.strip()]:
+        table_tokens = table_entry.split(".")
+        table_database_name = database_name
+        if len(table_tokens) == 2:
+            table_database_name = table_tokens[0]
+        if not table_database_name:
+            exit_with_error("No database specified for %s. Specify with fully qualified table name or with -d or --database" % table_entry)
+        query = """
+            SELECT TABLE_NAME
+            FROM INFORMATION_SCHEMA.TABLES
+            WHERE TABLE_SCHEMA = %s
+                AND TABLE_NAME LIKE %s
+                AND TABLE_TYPE = 'BASE TABLE'
+            ORDER BY TABLE_NAME
+            """
+        cursor = conn.cursor()
+        cursor.execute(query, (table_database_name, table_tokens[-1],))
+        table_names = [row[0] for row in cursor.fetchall()]
+        cursor.close()
+        if not table_names:
+            exit_with_error("No table matches %s" % table_entry)
+        for table_name in table_names:
+            if table_name.startswith("__oak_") or table_name.startswith("__arc_") or table_name.startswith("__chk_"):
+                continue
+            if (table_database_name, table_name,) not in batch_tables:
+                batch_tables.append((table_database_name, table_name,))
+    return batch_tables
+
+
+def get_batch_table_arguments(batch_table, batch_summary_file):
+    """
+    Command line arguments for altering a single table of the batch: same options as
+    parsed for this process, less the batch options, plus the table and its own summary file.
+    """
+    batch_options_dests = ["tables", "concurrency", "summary_file"]
+    parser = get_options_parser()
+    default_options = parser.get_default_values()
+    table_arguments = []
+    for option in parser.option_list:
+        if option.dest is None or option.dest in batch_options_dests:
+            continue
+        value = getattr(options, option.dest)
+        if value == getattr(default_options, option.dest):
+            continue
+        if option.action == "store_true":
+            if value:
+                table_arguments.append(option.get_opt_string())
+        elif option.action == "store_false":
+            if not value:
+                table_arguments.append(option.get_opt_string())
+        else:
+            table_arguments.append("%s=%s" % (option.get_opt_string(), value))
+    # Unbuffered, so that progress is read as it is printed
+    return [sys.executable, "-u", os.path.abspath(sys.argv[0])] + table_arguments + ["--table", "%s.%s" % batch_table, "--summary-file", batch_summary_file]
+
+
+def read_batch_table_output(batch_table_status):
+    """
+    Thread: relay output of a single table's alter, prefixed by the table name
+    """
+    table_process = batch_table_status["process"]
+    for line in iter(table_process.stdout.readline, ""):
+        line = line.rstrip()
+        batch_status_lock.acquire()
+        try:
+            batch_table_status["last_line"] = line
+            print "[%s] %s" % (batch_table_status["table"], line)
+            sys.stdout.flush()
+        finally:
+            batch_status_lock.release()
+    table_process.stdout.close()
+
+
+def start_batch_table(batch_table, summary_directory):
+    batch_table_status = {
+        "table": "%s.%s" % batch_table,
+        "summary_file": os.path.join(summary_directory, "%s.%s.json" % batch_table),
+        "start_time": time.time(),
+        "last_line": "",
+        }
+    table_arguments = get_batch_table_arguments(batch_table, batch_table_status["summary_file"])
+    batch_table_status["process"] = subprocess.Popen(table_arguments, stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+    reader = threading.Thread(target=read_batch_table_output, args=(batch_table_status,))
+    reader.setDaemon(True)
+    batch_table_status["reader"] = reader
+    reader.start()
+    verbose("Started altering %s" % batch_table_status["table"])
+    return batch_table_status
+
+
+def complete_batch_table(batch_table_status):
+    """
+    Collect the result of a completed table alter
+    """
+    batch_table_status["reader"].join()
+    exit_code = batch_table_status["process"].returncode
+    table_result = {
+        "table": batch_table_status["table"],
+        "status": "completed",
+        "elapsed_seconds": round(time.time() - batch_table_status["start_time"], 1),
+        }
+    if exit_code:
+        table_result["status"] = "failed"
+        table_result["error"] = batch_table_status["last_line"]
+    if os.path.exists(batch_table_status["summary_file"]):
+        summary_file = open(batch_table_status["summary_file"])
+        try:
+            table_result["summary"] = json.load(summary_file)
+        finally:
+            summary_file.close()
+        os.remove(batch_table_status["summary_file"])
+    verbose("%s %s in %s seconds" % (table_result["status"].capitalize(), table_result["table"], table_result["elapsed_seconds"]))
+    return table_result
+
+
+def get_batch_table_rows(table_result):
+    if "summary" not in table_result:
+        return 0
+    return sum([data_pass["num_rows"] for data_pass in table_result["summary"]["data_passes"] if data_pass["description"] == "Copying"])
+
+
+def get_batch_status_presentation(batch_tables, running, batch_results):
+    num_failed = len([table_result for table_result in batch_results if table_result["status"] == "failed"])
+    return "Batch: %d tables, %d completed, %d failed, %d running, %d pending" % (
+        len(batch_tables), len(batch_results) - num_failed, num_failed, len(running), len(batch_tables) - len(batch_results) - len(running))
+
+
+def alter_batch_tables():
+    """
+    Alter all tables matching --tables, running up to --concurrency alters at a time, each
+    in its own process. New alters are held back while server load or replication lag exceed
+    their thresholds; running alters check these same thresholds on their own.
+    Return the per table results.
+    """
+    batch_tables = get_batch_tables()
+    verbose("Altering %d tables, %d at a time" % (len(batch_tables), options.concurrency))
+    summary_directory = tempfile.mkdtemp(prefix="oak-online-alter-table-")
+    pending = list(batch_tables)
+    running = []
+    batch_results = []
+    last_report_time = time.time()
+    try:
+        while pending or running:
+            for batch_table_status in list(running):
+                if batch_table_status["process"].poll() is not None:
+                    running.remove(batch_table_status)
+                    batch_results.append(complete_batch_table(batch_table_status))
+                    verbose(get_batch_status_presentation(batch_tables, running, batch_results))
+            while pending and len(running) < options.concurrency:
+                throttle()
+                running.append(start_batch_table(pending.pop(0), summary_directory))
+            if time.time() - last_report_time >= 60:
+                last_report_time = time.time()
+                verbose(get_batch_status_presentation(batch_tables, running, batch_results))
+            time.sleep(0.5)
+    finally:
+        for batch_table_status in running:
+            if batch_table_status["process"].poll() is None:
+                batch_table_status["process"].terminate()
+        # Let each terminated alter clean up after itself
+        for batch_table_status in running:
+            batch_table_status["process"].wait()
+        if not os.listdir(summary_directory):
+            os.rmdir(summary_directory)
+    return batch_results
+
+
+def report_batch_results(batch_results):
+    """
+    Print the consolidated batch report, and write it to --summary-file
+    """
+    verbose("Batch report:")
+    for table_result in batch_results:
+        verbose("- %s: %s, %s seconds, %d rows copied%s" % (table_result["table"], table_result["status"], table_result["elapsed_seconds"], get_batch_table_rows(table_result),
+            table_result.get("error") and " (%s)" % table_result["error"] or ""))
+    num_failed = len([table_result for table_result in batch_results if table_result["status"] == "failed"])
+    verbose("%d tables completed, %d failed" % (len(batch_results) - num_failed, num_failed))
+    if options.summary_file:
+        summary = {
+            "alter": options.alter_statement,
+            "num_completed": len(batch_results) - num_failed,
+            "num_failed": num_failed,
+            "tables": batch_results,
+            }
+        summary_file = open(options.summary_file, "w")
+        try:
+            json.dump(summary, summary_file, indent=2)
+        finally:
+            summary_file.close()
+        verbose("Summary written to %s" % options.summary_file)
+    return num_failed
 
 
 def exit_with_error(error_message):
     """
     Notify, cleanup and exit.
+    Once a --checkpoint run is under way, its ghost table, triggers and checkpoint are kept
+    so that it can be resumed.
     """
-    print_error("Errors found. Initiating cleanup")
-    cleanup()
+    if resumable:
+        print_error("Errors found. Keeping ghost table, triggers and checkpoint. Rerun with --resume to continue, or with --cleanup to abort")
+        if conn:
+            try:
+                unlock_tables()
+            except Exception, err:
+                # Connection may well be gone; tables are then unlocked anyway
+                print_error("Cannot unlock tables: %s" % err)
+    elif options.tables:
+        # Each table's alter cleans up after itself
+        print_error("Errors found")
+    elif options.estimate:
+        # Only the estimation's own ghost table is ours to remove
+        print_error("Errors found")
+        if conn and ghost_table_name:
+            drop_table(ghost_table_name)
+    else:
+        print_error("Errors found. Initiating cleanup")
+        cleanup()
     print_error(error_message)
+    try:
+        if data_passes_metrics:
+            write_summary_file("failed")
+    except Exception, err:
+        print_error("Cannot write summary file: %s" % err)
     sys.exit(1)
 
 
 try:
     try:
         conn = None
+        prompted_password = None
+        workers_status_lock = threading.Lock()
+        workers_status = None
+        replication_lag_status = {}
+        metrics_lock = threading.Lock()
+        prepared_statements_lock = threading.Lock()
+        prepared_statements = {}
+        data_passes_metrics = []
+        cut_over_status = {}
+        estimate_results = {}
+        verification_status = {"num_mismatched_chunks": 0}
+        metadata_locks_instrumented = False
+        postponed_cut_over_status = {"signaled": False}
+        binlog_capture_status = {
+            "position": None,
+            "stop": False,
+            "error": None,
+            "thread": None,
+            "num_row_events": 0,
+            "num_rows_written": 0,
+            "column_ordinals": None,
+            "column_data_types": None,
+            }
+        batch_status_lock = threading.Lock()
+        deferred_keys_clauses = []
+        parent_side_foreign_keys = []
+        resumable = False
+        checkpoint_data_pass = None
+        checkpoint_range_end_values = None
         (options, args) = parse_options()
+        signal.signal(signal.SIGTERM, signal_terminate)
+        max_load_thresholds = parse_load_thresholds(options.max_load)
+        critical_load_thresholds = parse_load_thresholds(options.critical_load)
+
+        if options.tables:
+            if options.table or options.ghost:
+                exit_with_error("--tables cannot be used with --table or --ghost")
+            if options.prompt_password:
+                exit_with_error("--ask-pass cannot be used with --tables. Use --password or --defaults-file")
+            if options.concurrency < 1:
+                exit_with_error("--concurrency must be positive")
+            database_name = options.database
+            conn = open_connection()
+            if options.max_lag:
+                start_replication_lag_monitor()
+            batch_results = alter_batch_tables()
+            if report_batch_results(batch_results):
+                sys.exit(1)
+            sys.exit(0)
 
         if not options.table:
             exit_with_error("No table specified. Specify with -t or --table")
@@ -922,9 +3585,77 @@ try:
         if options.chunk_size <= 0:
             exit_with_error("Chunk size must be nonnegative number. You can leave the default 1000 if unsure")
 
+        if options.chunk_time_ms > 0:
+            if options.min_chunk_size <= 0 or options.min_chunk_size > options.max_chunk_size:
+                exit_with_error("--min-chunk-size must be positive and no greater than --max-chunk-size")
+            options.chunk_size = max(options.min_chunk_size, min(options.chunk_size, options.max_chunk_size))
+
+        if options.workers < 1:
+            exit_with_error("Number of workers must be positive")
+        if options.workers > 1:
+            if options.lock_chunks:
+                exit_with_error("--lock-chunks cannot be used with --workers")
+            # Workers bind their own sub-range values into the data pass queries
+            options.client_side_chunking = True
+
+        if options.chunk_plan_file:
+            options.plan_chunks = True
+        if options.plan_chunks:
+            if options.chunk_time_ms > 0:
+                exit_with_error("--chunk-time-ms cannot be used with --plan-chunks, where chunks are set in advance")
+            # Planned boundaries are bound into the data pass queries
+            options.client_side_chunking = True
+
+        if options.max_lag and not options.replicas:
+            exit_with_error("--max-lag requires --replicas")
+
+        if options.cut_over_flag_file and not options.postpone_cut_over:
+            exit_with_error("--cut-over-flag-file requires --postpone-cut-over")
+        if options.postpone_cut_over and options.ghost:
+            exit_with_error("--postpone-cut-over cannot be used with --ghost, which makes no cut-over")
+        if options.cut_over_lock_timeout < 1:
+            exit_with_error("--cut-over-lock-timeout must be at least 1 second")
+        if options.cut_over_retries < 1:
+            exit_with_error("--cut-over-retries must be positive")
+        if options.cut_over_rounds < 0:
+            exit_with_error("--cut-over-rounds must not be negative")
+
+        if options.capture == "binlog":
+            if options.skip_binlog:
+                exit_with_error("--skip-binlog cannot be used with --capture=binlog")
+            if options.ghost:
+                exit_with_error("--ghost cannot be used with --capture=binlog")
+            if options.checkpoint or options.resume:
+                exit_with_error("--checkpoint and --resume cannot be used with --capture=binlog")
+            if options.verify:
+                exit_with_error("--verify cannot be used with --capture=binlog, where the ghost table lags behind by design")
+            if options.binlog_batch_size <= 0:
+                exit_with_error("--binlog-batch-size must be positive")
+
+        if options.estimate:
+            if options.ghost or options.cleanup or options.resume:
+                exit_with_error("--estimate cannot be used with --ghost, --cleanup or --resume")
+            if options.estimate_samples < 1:
+                exit_with_error("--estimate-samples must be positive")
+
+        if options.foreign_keys_method != "none":
+            if options.capture == "binlog":
+                exit_with_error("--foreign-keys-method cannot be used with --capture=binlog")
+            if options.defer_secondary_keys:
+                exit_with_error("--foreign-keys-method cannot be used with --defer-secondary-keys, as foreign keys depend on keys")
+
+        if options.defer_secondary_keys and (options.checkpoint or options.resume):
+            exit_with_error("--defer-secondary-keys cannot be used with --checkpoint or --resume")
+
+        if options.resume:
+            options.checkpoint = True
+        if options.checkpoint and options.workers > 1:
+            exit_with_error("--checkpoint cannot be used with --workers")
+
         database_name = None
         original_table_name =  None
         archive_table_name = None
+        checkpoint_table_name = None
         after_delete_trigger_name = None
         after_update_trigger_name = None
         after_insert_trigger_name = None
@@ -947,15 +3678,19 @@ try:
             verbose("Binary logging for session disabled")
 
         ghost_table_name = None
-        if options.ghost:
+        if options.ghost and not options.resume:
             if table_exists(options.ghost):
                 exit_with_error("Ghost table: %s.%s already exists." % (database_name, options.ghost))
 
         if options.ghost:
             ghost_table_name = options.ghost
+        elif options.estimate:
+            # Do not interfere with an actual, possibly running, alter of this table
+            ghost_table_name = "__est_"+original_table_name
         else:
             ghost_table_name = "__oak_"+original_table_name
         archive_table_name = "__arc_"+original_table_name
+        checkpoint_table_name = "__chk_"+original_table_name
 
         after_delete_trigger_name = "%s_AD_oak" % original_table_name
         after_update_trigger_name = "%s_AU_oak" % original_table_name
@@ -965,23 +3700,42 @@ try:
             # All we do now is clean up
             cleanup()
         else:
+            if options.max_lag:
+                start_replication_lag_monitor()
             table_engine = get_table_engine()
             if not table_engine:
                 exit_with_error("Table %s.%s does not exist" % (database_name, original_table_name))
 
-            drop_custom_triggers()
-            if not validate_no_after_triggers_exist():
-                exit_with_error("Table must not have any 'AFTER' triggers defined.")
-
-            if not validate_no_foreign_keys_exist():
-                exit_with_error("Table must not have any foreign keys defined (neither as parent nor child).")
+            if options.resume:
+                validate_resumable()
+                resumable = True
+            elif options.estimate:
+                if not validate_no_after_triggers_exist():
+                    verbose("Note: table has AFTER triggers, which would fail the ALTER, unless with --capture=binlog")
+            else:
+                drop_custom_triggers()
+                if options.capture == "binlog":
+                    binlog_capture_error = validate_binlog_capture_possible()
+                    if binlog_capture_error:
+                        exit_with_error(binlog_capture_error)
+                elif not validate_no_after_triggers_exist():
+                    exit_with_error("Table must not have any 'AFTER' triggers defined.")
+
+            if options.foreign_keys_method == "none":
+                if not validate_no_foreign_keys_exist():
+                    exit_with_error("Table must not have any foreign keys defined (neither as parent nor child), unless with --foreign-keys-method.")
+            else:
+                if not validate_foreign_keys_supported():
+                    exit_with_error("Self referencing foreign keys are not supported")
+                parent_side_foreign_keys = get_parent_side_foreign_keys()
 
             original_table_unique_key_names_set = get_possible_unique_key_column_names_set(original_table_name)
             if not original_table_unique_key_names_set:
                 exit_with_error("Table must have a UNIQUE KEY on a single column")
 
-            create_ghost_table()
-            alter_ghost_table()
+            if not options.resume:
+                create_ghost_table()
+                alter_ghost_table()
 
             ghost_table_unique_key_names_set = get_possible_unique_key_column_names_set(ghost_table_name)
             if not original_table_unique_key_names_set:
@@ -997,21 +3751,62 @@ try:
 
             shared_columns = get_shared_columns()
 
-            create_custom_triggers()
+            if options.foreign_keys_method != "none" and not options.resume and not options.estimate:
+                add_ghost_foreign_keys()
+
+            if options.defer_secondary_keys and not options.estimate:
+                if options.capture == "triggers" and table_engine != "innodb":
+                    exit_with_error("--defer-secondary-keys requires InnoDB, where keys can be added while triggers write to the ghost table")
+                deferred_keys_clauses = defer_secondary_keys()
+
+            if options.estimate:
+                unique_key_min_values, unique_key_max_values, range_exists = get_unique_key_range()
+                estimate()
+                drop_table(ghost_table_name)
+                write_summary_file("estimated")
+                sys.exit(0)
+
+            if options.resume:
+                checkpoint_data_pass, checkpoint_range_end_values = read_checkpoint()
+            elif options.capture == "triggers":
+                create_custom_triggers()
+                if options.checkpoint:
+                    create_checkpoint_table()
+                    resumable = True
             lock_tables_write()
+            if options.capture == "binlog":
+                start_binlog_capture()
             unique_key_min_values, unique_key_max_values, range_exists = get_unique_key_range()
             unlock_tables()
 
-            copy_data_pass()
-            if not options.skip_delete_pass:
+            if checkpoint_data_pass not in ["delete", "verify"]:
+                copy_data_pass()
+            add_deferred_secondary_keys()
+            if checkpoint_data_pass != "verify" and is_delete_pass_required():
                 delete_data_pass()
+            if options.verify:
+                verify_data_pass()
+            resumable = False
+            drop_table(checkpoint_table_name)
 
             if options.ghost:
                 verbose("Ghost table creation completed. Note that triggers on %s.%s were not removed" % (database_name, original_table_name))
             else:
-                rename_tables()
+                if options.postpone_cut_over:
+                    wait_for_cut_over()
+                metadata_locks_instrumented = get_metadata_locks_instrumented()
+                if options.capture == "binlog":
+                    binlog_cut_over()
+                else:
+                    if options.foreign_keys_method == "drop-swap":
+                        cut_over(drop_swap_tables)
+                    else:
+                        cut_over(rename_tables)
+                if options.foreign_keys_method == "rebuild-constraints":
+                    rebuild_child_foreign_keys()
                 drop_table(archive_table_name)
                 verbose("ALTER TABLE completed")
+            write_summary_file("completed")
     except Exception, err:
         print Exception, err
         exit_with_error(err)